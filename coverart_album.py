@@ -23,10 +23,13 @@ the base model for the plugin to work on top of.
 '''
 
 from datetime import datetime, date
+from collections import deque
 import os
+import time
+import json
 import cgi
-import tempfile
 import gc
+import tempfile
 
 from gi.repository import RB
 from gi.repository import GObject
@@ -46,6 +49,10 @@ import coverart_rb3compat as rb3compat
 from coverart_utils import uniquify_and_sort
 from coverart_utils import dumpstack
 from coverart_utils import check_lastfm
+from coverart_utils import save_json_file
+from coverart_search_providers import get_search_providers
+from coverart_localart import FolderArtScanner
+from coverart_localart import EmbeddedArtExtractor
 import rb
 
 
@@ -57,6 +64,13 @@ ALBUM_LOAD_CHUNK = 50
 # default chunk of albums to process when loading covers
 COVER_LOAD_CHUNK = 5
 
+# bytes read at once when retrieving a cover from an uri
+COVER_READ_CHUNK = 64 * 1024
+
+# seconds after which the encoded covers left waiting to be stored on the
+# ext-db are considered abandoned (e.g. the store failed)
+COVER_FILE_LIFETIME = 86400
+
 
 class Cover(GObject.Object):
     '''
@@ -720,7 +734,8 @@ class AlbumsModel(GObject.Object):
         'album-updated': ((GObject.SIGNAL_RUN_LAST, None, (object, object))),
         'visual-updated': ((GObject.SIGNAL_RUN_LAST, None, (object, object))),
         'filter-changed': ((GObject.SIGNAL_RUN_FIRST, None, ())),
-        'album-added': ((GObject.SIGNAL_RUN_LAST, None, (object,)))
+        'album-added': ((GObject.SIGNAL_RUN_LAST, None, (object,))),
+        'visibility-changed': ((GObject.SIGNAL_RUN_LAST, None, (object, bool)))
     }
 
     # list of columns names and positions on the TreeModel
@@ -740,6 +755,9 @@ class AlbumsModel(GObject.Object):
         # filters
         self._filters = {}
 
+        # albums that pass the current filters
+        self._visible = set()
+
         # sorting idle call
         self._sort_process = None
 
@@ -778,6 +796,7 @@ class AlbumsModel(GObject.Object):
 
             self._tree_store.set(tree_iter, self.columns['tooltip'], tooltip,
                                  self.columns['markup'], markup, self.columns['show'], hidden)
+            self._set_visible(album, hidden)
 
             # reorder the album
             new_pos = self._albums.reorder(album)
@@ -843,6 +862,7 @@ class AlbumsModel(GObject.Object):
             self._iters[album.name] = {}
         self._iters[album.name][album.artist] = {'album': album,
                                                  'iter': tree_iter, 'ids': ids}
+        self._set_visible(album, values[self.columns['show']])
         self.emit('album-added', album)
         return tree_iter
 
@@ -862,6 +882,7 @@ class AlbumsModel(GObject.Object):
         '''
         print("album model remove")
         print(album)
+        self._set_visible(album, False)
         self._albums.remove(album)
         self._tree_store.remove(self._iters[album.name][album.artist]['iter'])
 
@@ -930,7 +951,9 @@ class AlbumsModel(GObject.Object):
 
         if not album:
             # get all the albums with the given name and look for a match
-            albums = [artist['album'] for artist in list(self._iters[name].values())]
+            # the album may be gone since the key was created
+            albums = [artist['album'] for artist in
+                      list(self._iters.get(name, {}).values())]
 
             for curr_album in albums:
                 if key.matches(curr_album.create_ext_db_key()):
@@ -944,6 +967,23 @@ class AlbumsModel(GObject.Object):
             self._tree_store.get_path(
                 self._iters[album.name][album.artist]['iter']))
 
+    def get_neighbours(self, album):
+        '''
+        Returns the visible albums right before and after the given one.
+
+        :param album: `Album` whose neighbours we want.
+        '''
+        tree_iter = self._filtered_store.get_iter(self.get_path(album))
+        neighbours = []
+
+        for sibling in (self._filtered_store.iter_previous(tree_iter),
+                        self._filtered_store.iter_next(tree_iter)):
+            if sibling:
+                neighbours.append(
+                    self._filtered_store[sibling][self.columns['album']])
+
+        return neighbours
+
     def find_first_visible(self, filter_key, filter_arg, start=None,
                            backwards=False):
         album_filter = AlbumFilters.keys[filter_key](filter_arg)
@@ -970,9 +1010,33 @@ class AlbumsModel(GObject.Object):
         '''
         album_iter = self._iters[album.name][album.artist]['iter']
 
-        if self._tree_store.iter_is_valid(album_iter):
+        if self._tree_store.iter_is_valid(album_iter) and \
+                self._tree_store[album_iter][self.columns['show']] != show:
             self._tree_store.set_value(album_iter, self.columns['show'], show)
 
+        self._set_visible(album, show)
+
+    def _set_visible(self, album, visible):
+        '''
+        Keeps track of the albums passing the filters, emitting
+        'visibility-changed' when an album starts or stops passing them.
+        '''
+        if visible != (album in self._visible):
+            if visible:
+                self._visible.add(album)
+            else:
+                self._visible.discard(album)
+
+            self.emit('visibility-changed', album, visible)
+
+    def is_visible(self, album):
+        '''
+        Indicates if an album passes the current filters.
+
+        :param album: `Album` to check.
+        '''
+        return album in self._visible
+
     @idle_iterator
     def _sort(self):
         def process(album, data):
@@ -1306,101 +1370,610 @@ class AlbumLoader(GObject.Object):
         self._album_manager.model.remove_filter('nay')
 
 
+class TokenBucket(object):
+    '''
+    Simple token bucket used to rate limit requests.
+
+    :param rate: `float` number of tokens refilled per second.
+    :param burst: `int` maximum number of tokens that can be saved up.
+    '''
+
+    def __init__(self, rate, burst=1):
+        self._rate = float(rate)
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._burst,
+                           self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def wait_time(self, tokens=1):
+        '''
+        Returns the seconds to wait until `tokens` tokens are available.
+        '''
+        self._refill()
+
+        if self._tokens >= tokens:
+            return 0
+
+        return (tokens - self._tokens) / self._rate
+
+    def consume(self):
+        '''
+        Takes a token. The bucket may go into debt, which has to be paid
+        back before it has tokens available again.
+        '''
+        self._refill()
+        self._tokens -= 1
+
+
+# requests per second allowed by the online search providers; the providers
+# are queried in order until one of them finds the cover
+PROVIDER_RATE_LIMITS = {
+    'lastfm-search': 4,
+    'musicbrainz-search': 1,
+    'coverartarchive-search': 1,
+    'discogs-search': 1,
+    'spotify-search': 2
+}
+
+# rate limit used for online providers not listed above
+DEFAULT_PROVIDER_RATE_LIMIT = 2
+
+# providers that don't go online and so don't need rate limiting
+LOCAL_PROVIDERS = ('embedded-search', 'local-search', 'cache-search')
+
+# bounds (in seconds) of the adaptive cover request timeout
+MIN_REQUEST_TIMEOUT = 10
+MAX_REQUEST_TIMEOUT = 40
+
+
+def ext_db_key_fields(key):
+    '''
+    Returns the fields of an `RB.ExtDBKey` as a list of [field, value] pairs,
+    which can be serialized and used to recreate the key.
+    '''
+    return [[field, key.get_field(field)] for field in key.get_field_names()]
+
+
+class CoverSearchFailures(object):
+    '''
+    Persistent record of the cover searches that didn't find a cover. Each
+    entry is identified by the fields of the coverobject's ext-db key, so
+    changing the tags the key is made of invalidates it.
+
+    :param path: `str` file where the failures are saved.
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._save_id = None
+
+        try:
+            with open(path) as failures_file:
+                self._failures = json.load(failures_file)
+        except Exception:
+            self._failures = {}
+
+    def _identifier(self, coverobject):
+        return json.dumps(ext_db_key_fields(coverobject.create_ext_db_key()))
+
+    def record(self, coverobject, providers, outcome):
+        '''
+        Records a failed search.
+
+        :param coverobject: covertype whose cover wasn't found.
+        :param providers: `list` of the providers that were searched.
+        :param outcome: `str` describing the failure ('not-found' or
+            'timeout').
+        '''
+        self._failures[self._identifier(coverobject)] = {
+            'providers': providers,
+            'time': time.time(),
+            'outcome': outcome}
+
+        self._schedule_save()
+
+    def forget(self, coverobject):
+        ''' Removes the failure recorded for the coverobject, if any. '''
+        if self._failures.pop(self._identifier(coverobject), None):
+            self._schedule_save()
+
+    def recently_failed(self, coverobject, providers, interval):
+        '''
+        Returns whether the search for the coverobject's cover failed within
+        the last `interval` seconds, using at least the given providers.
+        '''
+        failure = self._failures.get(self._identifier(coverobject))
+
+        if not failure or time.time() - failure['time'] > interval:
+            return False
+
+        return set(providers) <= set(failure['providers'])
+
+    def _schedule_save(self):
+        if self._save_id is None:
+            self._save_id = Gdk.threads_add_timeout_seconds(
+                GLib.PRIORITY_DEFAULT_IDLE, 2, self._save, None)
+
+    def _save(self, *args):
+        self._save_id = None
+
+        # drop the failures that are too old to matter anymore
+        limit = time.time() - 365 * 24 * 60 * 60
+        for identifier, failure in list(self._failures.items()):
+            if failure['time'] < limit:
+                del self._failures[identifier]
+
+        try:
+            save_json_file(self._path, self._failures)
+        except Exception as e:
+            print('Error while saving the cover search failures: ' + str(e))
+
+        return False
+
+
+class CoverSearchQueue(object):
+    '''
+    Queue of coverobjects waiting for their cover to be searched.
+
+    The queue is saved to disk as the ext-db keys of its elements (including
+    the ones being searched at the moment), so a search interrupted by
+    closing Rhythmbox can be resumed later on.
+
+    :param path: `str` file where the queue is saved.
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._queue = deque()
+        self._members = set()
+        self._taken = set()
+        self._save_id = None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __contains__(self, coverobject):
+        return coverobject in self._members
+
+    def extend(self, coverobjects):
+        '''
+        Appends the coverobjects that aren't already on the queue, returning
+        how many of them were added.
+        '''
+        added = 0
+
+        for coverobject in coverobjects:
+            if coverobject not in self._members:
+                self._members.add(coverobject)
+                self._queue.append(coverobject)
+                added += 1
+
+        if added:
+            self._schedule_save()
+
+        return added
+
+    def popleft(self):
+        '''
+        Takes the next coverobject out of the queue. It's kept on the saved
+        queue until `done` is called for it.
+        '''
+        coverobject = self._queue.popleft()
+        self._members.discard(coverobject)
+        self._taken.add(coverobject)
+
+        return coverobject
+
+    def done(self, coverobject):
+        ''' Marks a coverobject taken from the queue as searched. '''
+        self._taken.discard(coverobject)
+        self._schedule_save()
+
+    def clear(self):
+        self._queue.clear()
+        self._members.clear()
+        self._taken.clear()
+        self._schedule_save()
+
+    def _schedule_save(self):
+        if self._save_id is None:
+            self._save_id = Gdk.threads_add_timeout_seconds(
+                GLib.PRIORITY_DEFAULT_IDLE, 2, self._save, None)
+
+    def _save(self, *args):
+        self._save_id = None
+
+        keys = [ext_db_key_fields(coverobject.create_ext_db_key())
+                for coverobject in list(self._taken) + list(self._queue)]
+
+        try:
+            save_json_file(self._path, keys)
+        except Exception as e:
+            print('Error while saving the cover search queue: ' + str(e))
+
+        return False
+
+    def load(self, model):
+        '''
+        Returns the coverobjects of the given model that were on the saved
+        queue.
+
+        :param model: model with a `get_from_ext_db_key` method used to find
+            the coverobjects.
+        '''
+        try:
+            with open(self._path) as queue_file:
+                keys = json.load(queue_file)
+        except Exception:
+            return []
+
+        coverobjects = []
+        for fields in keys:
+            if not fields:
+                continue
+
+            key = RB.ExtDBKey.create_lookup(*fields[0])
+
+            for field, value in fields[1:]:
+                key.add_field(field, value)
+
+            coverobject = model.get_from_ext_db_key(key)
+
+            if coverobject:
+                coverobjects.append(coverobject)
+
+        return coverobjects
+
+
 class CoverRequester(GObject.Object):
+    '''
+    Searches the covers of a queue of coverobjects, running several requests
+    at the same time while respecting the rate limits of the enabled search
+    providers.
+
+    Requests that take too long are given up on: their slot is freed and
+    their answer, if it ever comes, is ignored. The time allowed to a request
+    adapts to the latency observed on the previous ones.
+
+    The queue is kept on the plugin's cache dir so it can be resumed later.
+    Searches that find nothing are recorded, so they aren't repeated until
+    `retry_days` have passed unless explicitly requested.
+
+    :param cover_db: `RB.ExtDB` used to request the covers.
+    '''
+    # properties
+    max_requests = GObject.property(type=int, default=4)
+    retry_days = GObject.property(type=int, default=7)
+
     def __init__(self, cover_db):
         super(CoverRequester, self).__init__()
 
         self._cover_db = cover_db
         self.unknown_cover = None
         self._callback = None
-        self._queue = []
-        self._queue_id = 0
+        self._queue = CoverSearchQueue(
+            RB.user_cache_dir() + '/coverart_browser/search_queue/' +
+            cover_db.props.name + '.json')
+        self.failures = CoverSearchFailures(
+            RB.user_cache_dir() + '/coverart_browser/search_failures/' +
+            cover_db.props.name + '.json')
+        self._in_flight = {}
+        self._abandoned = set()
+        self._request_id = 0
+        self._schedule_id = None
         self._running = False
-        self._stop = False
+        self._limiters = {}
+
+        # smoothed latency and its deviation, as done for TCP timeouts
+        self._latency = None
+        self._deviation = 0
+
+        # progress of the current search
+        self.searched = 0
+        self.total = 0
+
+        self._connect_properties()
+
+    def _connect_properties(self):
+        gs = GSetting()
+        setting = gs.get_setting(gs.Path.PLUGIN)
 
-    def add_to_queue(self, coverobjects, callback):
-        ''' Adds coverobjects to the queue if they're not already there. '''
-        self._queue.extend(
-            [coverobject for coverobject in coverobjects if coverobject not in self._queue])
+        setting.bind(gs.PluginKey.COVER_SEARCH_REQUESTS, self, 'max_requests',
+                     Gio.SettingsBindFlags.GET)
+        setting.bind(gs.PluginKey.COVER_SEARCH_RETRY, self, 'retry_days',
+                     Gio.SettingsBindFlags.GET)
+
+    @property
+    def searching(self):
+        '''
+        Returns the coverobjects that are being searched right now.
+        '''
+        return [request[0] for request in list(self._in_flight.values())]
+
+    def _online_providers(self):
+        return [provider for provider in get_search_providers()
+                if provider not in LOCAL_PROVIDERS]
+
+    def _skip_failed(self, coverobjects):
+        ''' Filters out the coverobjects whose search failed recently. '''
+        providers = self._online_providers()
+        interval = self.retry_days * 24 * 60 * 60
+
+        return [coverobject for coverobject in coverobjects
+                if not self.failures.recently_failed(coverobject, providers,
+                                                     interval)]
+
+    def add_to_queue(self, coverobjects, callback, force=True):
+        '''
+        Adds coverobjects to the queue if they're not already there.
+        Unless forced, the ones whose search failed recently are skipped.
+        '''
+        if not force:
+            coverobjects = self._skip_failed(coverobjects)
+
+        self.total += self._queue.extend(coverobjects)
 
         self._start_process(callback)
 
-    def replace_queue(self, coverobjects, callback):
-        ''' Completely replace the current queue. '''
-        self._queue = coverobjects
+    def replace_queue(self, coverobjects, callback, force=False):
+        '''
+        Completely replace the current queue.
+        Unless forced, the coverobjects whose search failed recently are
+        skipped.
+        '''
+        if not force:
+            coverobjects = self._skip_failed(coverobjects)
+
+        self._queue.clear()
+        added = self._queue.extend(coverobjects)
+        self.total = self.searched + len(self._in_flight) + added
 
         self._start_process(callback)
 
+    def saved_queue(self, model):
+        '''
+        Returns the coverobjects left on the queue saved by a previous,
+        unfinished, search.
+        '''
+        if self._running:
+            return []
+
+        return self._queue.load(model)
+
     def _start_process(self, callback):
         ''' Starts the queue processing if it isn't running already '''
         if not self._running:
             self._callback = callback
             self._running = True
-            self._process_queue()
+            self._create_limiters()
+            self._schedule()
+
+    def _create_limiters(self):
+        '''
+        Creates a rate limiter for each enabled online search provider.
+        '''
+        limiters = {}
+
+        for provider in self._online_providers():
+            if provider in self._limiters:
+                limiters[provider] = self._limiters[provider]
+            else:
+                rate = PROVIDER_RATE_LIMITS.get(provider,
+                                                DEFAULT_PROVIDER_RATE_LIMIT)
+                limiters[provider] = TokenBucket(rate)
+
+        self._limiters = limiters
+
+    def _schedule(self, delay=0):
+        ''' Makes sure the queue is processed again after `delay` secs. '''
+        if self._schedule_id is None:
+            self._schedule_id = Gdk.threads_add_timeout(
+                GLib.PRIORITY_DEFAULT_IDLE, int(delay * 1000),
+                self._process_queue, None)
 
-    def _process_queue(self):
+    def _process_queue(self, *args):
         '''
         Main method that process the queue.
-        First, it tries to adquire a lock on the queue, and if it can, pops
-        the next element of the queue and process it.
-        The lock makes sure that only one request is done at a time, and
-        successfully ignores false timeouts or strand callbacks.
+        It starts new requests while there are free request slots and the
+        providers' rate limits allow it.
         '''
-        # process the next element in the queue
-        while self._queue:
-            coverobject = self._queue.pop(0)
+        self._schedule_id = None
 
-            if coverobject.cover is self.unknown_cover:
+        # requests that timed out keep running on the ext-db, so they still
+        # take up a slot until they call back
+        while self._queue and \
+                len(self._in_flight) + len(self._abandoned) < self.max_requests:
+            wait = self._providers_wait()
+
+            if wait > 0:
+                # come back when the providers accept a new request
+                self._schedule(wait)
                 break
-        else:
-            coverobject = None
 
-        if coverobject:
-            # inform the current coverobject being searched
-            self._callback(coverobject)
+            coverobject = self._queue.popleft()
+
+            if coverobject.cover is not self.unknown_cover:
+                # the cover was found in the meantime
+                self._queue.done(coverobject)
+                self.searched += 1
+                continue
 
-            # start the request
-            self._queue_id += 1
-            self._search_for_cover(coverobject, self._queue_id)
+            self._search_for_cover(coverobject)
 
-            # add a timeout to the request
-            Gdk.threads_add_timeout_seconds(GLib.PRIORITY_DEFAULT_IDLE, 40,
-                                            self._next, self._queue_id)
+        if self._queue or self._in_flight:
+            # inform about the progress of the search
+            self._callback(self)
         else:
             # if there're no more elements, clean the state of the requester
-            self._running = False
-            self._callback(None)
+            self._finish()
+
+        return False
+
+    def _providers_wait(self):
+        '''
+        Returns the seconds to wait until a new request can be started.
+        Every request that gets to the online providers queries the first
+        one, while the rest are only queried when the previous ones don't
+        find the cover, so they just need to be out of debt.
+        '''
+        providers = self._online_providers()
+
+        if not providers or providers[0] not in self._limiters:
+            return 0
+
+        wait = [self._limiters[providers[0]].wait_time()]
+        wait += [self._limiters[provider].wait_time(0)
+                 for provider in providers[1:] if provider in self._limiters]
 
-    def _search_for_cover(self, coverobject, search_id):
+        return max(wait)
+
+    def _charge_providers(self, providers):
+        ''' Takes a token from the given providers' rate limiters. '''
+        for provider in providers:
+            if provider in self._limiters:
+                self._limiters[provider].consume()
+
+    def _finish(self):
+        self._running = False
+        self.searched = 0
+        self.total = 0
+        self._callback(None)
+
+    def _timeout(self):
+        ''' Returns the seconds a request is allowed to take. '''
+        if self._latency is None:
+            return MAX_REQUEST_TIMEOUT
+
+        timeout = self._latency + 4 * self._deviation
+
+        return min(MAX_REQUEST_TIMEOUT, max(MIN_REQUEST_TIMEOUT, timeout))
+
+    def _update_latency(self, latency):
+        if self._latency is None:
+            self._latency = latency
+            self._deviation = latency / 2
+        else:
+            error = latency - self._latency
+            self._latency += error / 8
+            self._deviation += (abs(error) - self._deviation) / 4
+
+    def _search_for_cover(self, coverobject):
         '''
-        Actively requests a cover to the cover_db, calling
-        the callback given once the process finishes (since it generally is
-        asynchronous).
+        Actively requests a cover to the cover_db, calling `_request_finished`
+        once the process finishes (since it generally is asynchronous).
         For more information on the callback arguments, check
         `RB.ExtDB.request` documentation.
 
         :param coverobject: covertype for which search the cover.
         '''
+        self._request_id += 1
+        request_id = self._request_id
+
+        # add a timeout to the request
+        timeout_id = Gdk.threads_add_timeout_seconds(
+            GLib.PRIORITY_DEFAULT_IDLE, int(self._timeout()),
+            self._request_timeout, request_id)
+
+        providers = self._online_providers()
+        self._in_flight[request_id] = (coverobject, time.time(), timeout_id,
+                                       providers)
+
+        # the first online provider is queried unless the cover is found
+        # locally; the rest are charged once it's known they were queried
+        self._charge_providers(providers[:1])
+
         # create a key and request the cover
         key = coverobject.create_ext_db_key()
-        provides = self._cover_db.request(key, self._next, search_id)
+        provides = self._cover_db.request(key, self._request_finished,
+                                          request_id)
 
         if not provides:
             # in case there is no provider, call the callback immediately
-            self._next(search_id)
+            self._request_finished(request_id)
 
-    def _next(self, *args):
-        ''' Advances to the next coverobject to process. '''
+    def _request_finished(self, *args):
+        ''' Callback called when a cover request finishes. '''
         # get the id of the search
-        search_id = args[-1]
-        if search_id == self._queue_id:
-            # only process the next element if the search_id is the same as
-            # the current id. Otherwise, this is a invalid call
-            self._process_queue()
+        request_id = args[-1]
+
+        if request_id in self._abandoned:
+            # the request timed out already, but its slot is free now
+            self._abandoned.discard(request_id)
+
+            if self._running:
+                self._schedule()
+
+        if request_id not in self._in_flight:
+            # the request timed out or was given up on already
+            return
+
+        coverobject, started, timeout_id, providers = \
+            self._in_flight.pop(request_id)
+        GLib.source_remove(timeout_id)
+        self._queue.done(coverobject)
+
+        # the callback receives the found filename before the data, if any
+        filename = args[-3] if len(args) >= 4 else None
+
+        if filename:
+            self.failures.forget(coverobject)
+        else:
+            # every provider was queried without finding the cover
+            self._charge_providers(providers[1:])
+            self.failures.record(coverobject, providers, 'not-found')
+
+        self._update_latency(time.time() - started)
+        self.searched += 1
+
+        self._schedule()
+
+    def _request_timeout(self, request_id):
+        '''
+        Gives up on a request that took too long. The ext-db has no way to
+        cancel a single request, so it's dropped from the requests in flight
+        and its answer is ignored, but it keeps its slot until it calls back.
+        '''
+        if request_id in self._in_flight:
+            coverobject, _, _, providers = self._in_flight.pop(request_id)
+            self._abandoned.add(request_id)
+            self._queue.done(coverobject)
+            self._charge_providers(providers[1:])
+            self.failures.record(coverobject, providers, 'timeout')
+
+            # back off, providers seem to be struggling
+            if self._latency is not None:
+                self._latency = min(MAX_REQUEST_TIMEOUT, self._latency * 2)
+
+            self.searched += 1
+
+            self._schedule()
+
+        return False
 
     def stop(self):
-        ''' Clears the queue, forcing the requester to stop. '''
-        del self._queue[:]
+        '''
+        Clears the queue and gives up on the running requests, ignoring
+        their answers. They keep their slots until they call back.
+        '''
+        self._queue.clear()
+
+        for request_id, request in list(self._in_flight.items()):
+            GLib.source_remove(request[2])
+            self._abandoned.add(request_id)
+
+        self._in_flight.clear()
+
+        if self._running:
+            if self._schedule_id is not None:
+                GLib.source_remove(self._schedule_id)
+                self._schedule_id = None
+
+            self._finish()
 
 
 class CoverManager(GObject.Object):
@@ -1421,12 +1994,14 @@ class CoverManager(GObject.Object):
     has_finished_loading = False
     force_lastfm_check = False
     cover_size = GObject.property(type=int, default=0)
+    max_cover_size = GObject.property(type=int, default=1000)
 
     def __init__(self, plugin, manager):
         super(CoverManager, self).__init__()
         # self.cover_db = None to be defined by inherited class
         self._manager = manager
         self._requester = CoverRequester(self.cover_db)
+        self._search_resumed = False
 
         self.unknown_cover = None  #to be defined by inherited class
         self.album_manager = None  #to be defined by inherited class
@@ -1436,6 +2011,11 @@ class CoverManager(GObject.Object):
                                             self.coverart_added_callback)
         self.connect('load-finished', self._on_load_finished)
 
+        gs = GSetting()
+        setting = gs.get_setting(gs.Path.PLUGIN)
+        setting.bind(gs.PluginKey.COVER_MAX_SIZE, self, 'max_cover_size',
+                     Gio.SettingsBindFlags.GET)
+
     def _on_load_finished(self, *args):
         self.has_finished_loading = True
 
@@ -1474,6 +2054,7 @@ class CoverManager(GObject.Object):
 
             if coverobject:
                 coverobject.cover = self.create_cover(path)
+                self._requester.failures.forget(coverobject)
 
     def load_cover(self, coverobject):
         '''
@@ -1507,17 +2088,22 @@ class CoverManager(GObject.Object):
 
         self._load_covers(iter(coverobjects), total=len(coverobjects), progress=0.)
 
-    def search_covers(self, coverobjects=None, callback=lambda *_: None):
+    def search_covers(self, coverobjects=None, callback=lambda *_: None,
+                      force=None):
         '''
-        Request all the albums' covers, one by one, periodically calling a
-        callback to inform the status of the process.
-        The callback should accept one argument: the album which cover is
-        being requested. When the argument passed is None, it means the
+        Request all the albums' covers, periodically calling a callback to
+        inform the status of the process.
+        The callback should accept one argument: the `CoverRequester` doing
+        the search, whose `searched`, `total` and `searching` attributes
+        describe its progress. When the argument passed is None, it means the
         process has finished.
 
         :param albums: `list` of `Album` for which look for covers.
-        :param callback: `callable` to periodically inform when an album's
-            cover is being searched.
+        :param callback: `callable` to periodically inform about the progress
+            of the search.
+        :param force: `bool` indicating whether to search the albums whose
+            search recently failed. By default, they are only searched when
+            specific albums are given.
         '''
         if not check_lastfm(self.force_lastfm_check):
             # display error message and quit
@@ -1532,11 +2118,35 @@ class CoverManager(GObject.Object):
 
             return
 
+        if force is None:
+            force = coverobjects is not None
+
         if coverobjects is None:
             self._requester.replace_queue(
-                list(self._manager.model.get_all()), callback)
+                list(self._manager.model.get_all()), callback, force)
         else:
-            self._requester.add_to_queue(coverobjects, callback)
+            self._requester.add_to_queue(coverobjects, callback, force)
+
+    def resume_cover_search(self, callback=lambda *_: None):
+        '''
+        Resumes the cover search left unfinished the last time Rhythmbox was
+        closed, if any. Returns whether a search was resumed.
+
+        :param callback: `callable` to periodically inform about the progress
+            of the search. See `search_covers`.
+        '''
+        if self._search_resumed:
+            return False
+
+        self._search_resumed = True
+        coverobjects = self._requester.saved_queue(self._manager.model)
+
+        if not coverobjects or not check_lastfm(self.force_lastfm_check):
+            return False
+
+        self._requester.add_to_queue(coverobjects, callback, False)
+
+        return True
 
     def cancel_cover_request(self):
         '''
@@ -1554,41 +2164,92 @@ class CoverManager(GObject.Object):
         In the case a uri is given instead of the pixbuf, it will first try to
         retrieve an image from the uri, then recall this method with the
         obtained pixbuf.
+        Images bigger than `max_cover_size` are downscaled before storing
+        them.
 
         :param album: `Album` for which the cover is.
         :param pixbuf: `GkdPixbuf.Pixbuf` to use as a cover.
         :param uri: `str` from where we should try to retrieve an image.
         '''
         if pixbuf:
+            width, height = self._scaled_size(pixbuf.get_width(),
+                                              pixbuf.get_height())
+
+            if width != pixbuf.get_width() or height != pixbuf.get_height():
+                pixbuf = pixbuf.scale_simple(width, height,
+                                             GdkPixbuf.InterpType.BILINEAR)
+
             self.update_pixbuf_cover(coverobject, pixbuf)
         elif uri:
-            parsed = rb3compat.urlparse(uri)
+            # the image is decoded (and downscaled) while it's being read
+            loader = GdkPixbuf.PixbufLoader()
+            loader.connect('size-prepared', self._on_size_prepared)
 
-            if parsed.scheme == 'file':
-                # local file, load it on a pixbuf and assign it
-                path = rb3compat.url2pathname(uri.strip()).replace('file://', '')
+            Gio.File.new_for_uri(uri.strip()).read_async(
+                GLib.PRIORITY_DEFAULT, None, self._cover_stream_opened,
+                (coverobject, loader))
 
-                if os.path.exists(path):
-                    cover = GdkPixbuf.Pixbuf.new_from_file(path)
-                    self.update_cover(coverobject, cover)
-            else:
-                # assume is a remote uri and we have to retrieve the data
-                def cover_update(data, coverobject):
-                    # save the cover on a temp file and open it as a pixbuf
-                    with tempfile.NamedTemporaryFile(mode='wb') as tmp:
-                        try:
-                            tmp.write(data)
-                            tmp.flush()
-                            cover = GdkPixbuf.Pixbuf.new_from_file(tmp.name)
+    def _scaled_size(self, width, height):
+        '''
+        Returns the size an image should have to fit on `max_cover_size`.
+        '''
+        biggest = max(width, height)
+
+        if not self.max_cover_size or biggest <= self.max_cover_size:
+            return width, height
+
+        scale = float(self.max_cover_size) / biggest
+
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def _on_size_prepared(self, loader, width, height):
+        scaled_width, scaled_height = self._scaled_size(width, height)
+
+        if scaled_width != width or scaled_height != height:
+            loader.set_size(scaled_width, scaled_height)
+
+    def _cover_stream_opened(self, gfile, result, data):
+        try:
+            stream = gfile.read_finish(result)
+        except GLib.GError as e:
+            print("The URI couldn't be opened: " + str(e))
+            return
+
+        stream.read_bytes_async(COVER_READ_CHUNK, GLib.PRIORITY_DEFAULT, None,
+                                self._cover_stream_read, data)
+
+    def _cover_stream_read(self, stream, result, data):
+        coverobject, loader = data
+
+        try:
+            chunk = stream.read_bytes_finish(result)
+
+            if chunk.get_size():
+                loader.write(chunk.get_data())
+
+                stream.read_bytes_async(COVER_READ_CHUNK,
+                                        GLib.PRIORITY_DEFAULT, None,
+                                        self._cover_stream_read, data)
+                return
+
+            loader.close()
+            pixbuf = loader.get_pixbuf()
+        except GLib.GError:
+            pixbuf = None
 
-                            # set the new cover
-                            self.update_cover(coverobject, cover)
-                        except:
-                            print("The URI doesn't point to an image or " + \
-                                  "the image couldn't be opened.")
+            try:
+                loader.close()
+            except GLib.GError:
+                pass
 
-                async = rb.Loader()
-                async.get_url(uri, cover_update, coverobject)
+        stream.close(None)
+
+        if pixbuf:
+            # the pixbuf is already scaled down, store it as it is
+            self.update_pixbuf_cover(coverobject, pixbuf)
+        else:
+            print("The URI doesn't point to an image or " + \
+                  "the image couldn't be opened.")
 
 
 class AlbumCoverManager(CoverManager):
@@ -1601,6 +2262,14 @@ class AlbumCoverManager(CoverManager):
         super(AlbumCoverManager, self).__init__(plugin, album_manager)
 
         self.album_manager = album_manager
+        # encoded covers waiting to be stored, by storage key
+        self._cover_files = {}
+        self._cover_files_dir = os.path.join(RB.user_cache_dir(),
+                                             'coverart_browser', 'covers')
+        self._cover_files_cleaned = False
+        self._folder_art = FolderArtScanner(self)
+        self._embedded_art = EmbeddedArtExtractor(
+            self, plugin.shell.props.shell_player)
         self._connect_properties()
         self._connect_signals(plugin)
 
@@ -1608,6 +2277,12 @@ class AlbumCoverManager(CoverManager):
         self.create_unknown_cover(plugin)
 
     def _connect_signals(self, plugin):
+        # only look for local covers once, not every time the covers are
+        # reloaded (e.g. when their size changes)
+        self._local_covers_id = self.connect('load-finished',
+                                             self._find_local_covers)
+        self.connect('load-finished', self._remove_abandoned_cover_files)
+        self.cover_db.connect('added', self._on_cover_file_stored)
         self.connect('notify::cover-size', self._on_cover_size_changed)
         self.connect('notify::add-shadow', self._on_add_shadow_changed, plugin)
         self.connect('notify::shadow-image', self._on_add_shadow_changed,
@@ -1667,20 +2342,131 @@ class AlbumCoverManager(CoverManager):
     def update_item_width(self):
         self.album_manager.current_view.resize_icon(self.cover_size)
 
-    def update_pixbuf_cover(self, coverobject, pixbuf):
-        # if it's a pixbuf, assign it to all the artist for the album
-        key = RB.ExtDBKey.create_storage('album', coverobject.name)
-        key.add_field('artist', coverobject.artist)
+    def _find_local_covers(self, *args):
+        '''
+        Looks for the missing covers on the albums' folders and then, for the
+        albums still without cover, inside their tracks.
+        '''
+        self.disconnect(self._local_covers_id)
+
+        albums = [album for album in self.album_manager.model.get_all()
+                  if album.cover is self.unknown_cover]
+
+        self.cancel_local_covers()
+        self._folder_art.scan(albums, self._embedded_art.extract)
 
-        self.cover_db.store(key, RB.ExtDBSourceType.USER_EXPLICIT,
-                            pixbuf)
+    def cancel_local_covers(self):
+        '''
+        Stops looking for covers on the albums' folders and tracks.
+        '''
+        self._folder_art.cancel()
+        self._embedded_art.cancel()
+
+    def _storage_keys(self, coverobject):
+        # the cover is assigned to the album artist and all the track artists
+        artists = [coverobject.artist] + coverobject.artists.split(', ')
 
-        for artist in coverobject.artists.split(', '):
+        for artist in uniquify_and_sort(artists):
             key = RB.ExtDBKey.create_storage('album', coverobject.name)
             key.add_field('artist', artist)
 
-            self.cover_db.store(key, RB.ExtDBSourceType.USER_EXPLICIT,
-                                pixbuf)
+            yield key
+
+    def update_pixbuf_cover(self, coverobject, pixbuf):
+        # encode the pixbuf once to a temporary file and assign it to all the
+        # artists of the album; the file is removed once the ext-db stored it
+        path = None
+
+        try:
+            if not os.path.exists(self._cover_files_dir):
+                os.makedirs(self._cover_files_dir)
+
+            if pixbuf.get_has_alpha():
+                cover_type, suffix, options = 'png', '.png', ([], [])
+            else:
+                cover_type, suffix, options = 'jpeg', '.jpg', (['quality'],
+                                                               ['95'])
+
+            fd, path = tempfile.mkstemp(suffix=suffix,
+                                        dir=self._cover_files_dir)
+            os.close(fd)
+
+            pixbuf.savev(path, cover_type, *options)
+        except (GLib.GError, OSError) as e:
+            print("The cover couldn't be saved: " + str(e))
+
+            if path:
+                self._remove_cover_file(path)
+
+            # store the pixbuf directly instead
+            self.store_cover_pixbuf(coverobject, pixbuf)
+            return
+
+        for key in self._storage_keys(coverobject):
+            self._cover_files[repr(ext_db_key_fields(key))] = path
+
+        self.store_cover_uri(coverobject, GLib.filename_to_uri(path, None))
+
+    def _on_cover_file_stored(self, ext_db, key, path, pixbuf):
+        cover_file = self._cover_files.pop(repr(ext_db_key_fields(key)),
+                                           None)
+
+        if cover_file and cover_file not in self._cover_files.values():
+            # all the keys using the file are stored
+            self._remove_cover_file(cover_file)
+
+    def _remove_cover_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _remove_abandoned_cover_files(self, *args):
+        '''
+        Removes the encoded covers left behind by stores that never finished
+        on previous sessions.
+        '''
+        if self._cover_files_cleaned or \
+                not os.path.isdir(self._cover_files_dir):
+            return
+
+        self._cover_files_cleaned = True
+
+        limit = time.time() - COVER_FILE_LIFETIME
+
+        with os.scandir(self._cover_files_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < limit:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def store_cover_pixbuf(self, coverobject, pixbuf,
+                           source_type=RB.ExtDBSourceType.USER_EXPLICIT):
+        '''
+        Stores a pixbuf as the cover of an album.
+
+        :param coverobject: `Album` for which the cover is.
+        :param pixbuf: `GdkPixbuf.Pixbuf` to use as a cover.
+        :param source_type: `RB.ExtDBSourceType` indicating where the image
+            comes from.
+        '''
+        for key in self._storage_keys(coverobject):
+            self.cover_db.store(key, source_type, pixbuf)
+
+    def store_cover_uri(self, coverobject, uri,
+                        source_type=RB.ExtDBSourceType.USER_EXPLICIT):
+        '''
+        Stores the image on the given uri as the cover of an album.
+
+        :param coverobject: `Album` for which the cover is.
+        :param uri: `str` uri of the image.
+        :param source_type: `RB.ExtDBSourceType` indicating where the image
+            comes from.
+        '''
+        for key in self._storage_keys(coverobject):
+            self.cover_db.store_uri(key, source_type, uri)
 
     @idle_iterator
     def _resize_covers(self):
@@ -1827,15 +2613,17 @@ class AlbumManager(GObject.Object):
 
         self.current_view = current_view
         self.db = plugin.shell.props.db
+        self._plugin = plugin
 
         self.model = AlbumsModel()
 
         # initialize managers
         self.loader = AlbumLoader(self)
         self.cover_man = AlbumCoverManager(plugin, self)
-        from coverart_artistview import ArtistManager
 
-        self.artist_man = ArtistManager(plugin, self, plugin.shell)
+        # the artist manager is only created when first needed
+        self._artist_man = None
+        self._albums_loaded = False
         self.text_man = TextManager(self)
         self._show_policy = current_view.show_policy.initialise(self)
 
@@ -1857,6 +2645,28 @@ class AlbumManager(GObject.Object):
         if not toolbar_type or toolbar_type == "album":
             self.model.sort()
 
+    @property
+    def artist_man(self):
+        '''
+        `ArtistManager` used by the artist view. It's created, and the artists
+        loaded, the first time it's requested so users that never open the
+        artist view don't pay for it.
+        '''
+        if not self._artist_man:
+            from coverart_artistview import ArtistManager
+
+            self._artist_man = ArtistManager(self._plugin, self,
+                                             self._plugin.shell)
+
+            if self._albums_loaded:
+                self._artist_man.loader.load_artists()
+
+        return self._artist_man
+
     def _load_finished_callback(self, *args):
-        self.artist_man.loader.load_artists()
+        self._albums_loaded = True
+
+        if self._artist_man:
+            self._artist_man.loader.load_artists()
+
         self.cover_man.load_covers()
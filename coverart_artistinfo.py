@@ -24,7 +24,6 @@ import urllib.parse
 import json
 import gettext
 
-from mako.template import Template
 from gi.repository import WebKit
 from gi.repository import GObject
 from gi.repository import Gtk
@@ -39,6 +38,12 @@ from coverart_utils import get_stock_size
 from coverart_browser_prefs import GSetting
 from coverart_browser_prefs import CoverLocale
 from coverart_utils import create_button_image
+from coverart_utils import LRUCache
+from coverart_utils import WorkerPool
+from coverart_utils import get_template
+from coverart_utils import clean_url_cache
+from coverart_utils import discard_url_cache_entry
+from coverart_utils import render_template_cached
 
 
 gettext.install('rhythmbox', RB.locale_dir())
@@ -61,6 +66,12 @@ def lastfm_datasource_link(path):
 LASTFM_NO_ACCOUNT_ERROR = _(
     "Enable LastFM plugin and log in first")
 
+# number of artists/albums whose parsed information is kept in memory
+INFO_CACHE_SIZE = 50
+
+# milliseconds the selection has to stay the same before loading its info
+SELECTION_DELAY = 250
+
 
 class ArtistInfoWebView(WebKit.WebView):
     def __init(self, *args, **kwargs):
@@ -134,6 +145,11 @@ class ArtistInfoPane(GObject.GObject):
         self.current_album_title = None
         self.current = 'artist'
         self._from_paned_handle = 0
+        self._select_id = None
+        # neighbours of the current selection to prefetch once it settles
+        self._prefetch_artists = []
+        # artists already prefetched (or being prefetched), by view
+        self._prefetched = LRUCache(INFO_CACHE_SIZE)
 
         self.stack = stack
         self.stack.set_transition_type(Gtk.StackTransitionType.SLIDE_LEFT_RIGHT)
@@ -156,8 +172,8 @@ class ArtistInfoPane(GObject.GObject):
                                          refresh=7,
                                          lifetime=30)
 
-        self.info_cache.clean()
-        self.ranking_cache.clean()
+        clean_url_cache(self.info_cache)
+        clean_url_cache(self.ranking_cache)
 
         self.ds['link'] = LinksDataSource()
         self.ds['artist'] = ArtistDataSource(self.info_cache,
@@ -366,13 +382,61 @@ class ArtistInfoPane(GObject.GObject):
 
     def select_artist(self, widget, artist, album_title):
         print("artist %s title %s" % (artist, album_title))
+        self.current_album_title = album_title
+        self.current_artist = artist
+        self._prefetch_artists = []
+
+        # wait for the selection to settle before loading anything
+        if self._select_id:
+            GLib.source_remove(self._select_id)
+
+        self._select_id = Gdk.threads_add_timeout(GLib.PRIORITY_DEFAULT_IDLE,
+                                                  SELECTION_DELAY,
+                                                  self._load_selection, None)
+
+    def _load_selection(self, *args):
+        self._select_id = None
+
         if self._get_child_width() > self.min_paned_pos:
-            self.view[self.current].reload(artist, album_title)
+            self.view[self.current].reload(self.current_artist,
+                                           self.current_album_title)
+            self._prefetch_neighbours()
         else:
             self.view[self.current].blank_view()
 
-        self.current_album_title = album_title
-        self.current_artist = artist
+        return False
+
+    def prefetch(self, artists):
+        '''
+        Prepares in the background the information of the given artists
+        (usually the neighbours of the current selection), so it's shown
+        right away when they are selected. Nothing is fetched until the
+        selection settles.
+
+        :param artists: `list` of artist names.
+        '''
+        self._prefetch_artists = artists
+
+    def _prefetch_neighbours(self):
+        ds = self.ds.get(self.current)
+        artists = self._prefetch_artists
+        self._prefetch_artists = []
+
+        if not hasattr(ds, 'prefetch'):
+            return
+
+        def prefetch_artists(*args):
+            for artist in artists:
+                key = (self.current, artist)
+
+                if artist != self.current_artist and \
+                        key not in self._prefetched:
+                    self._prefetched.put(key, True)
+                    ds.prefetch(artist)
+
+            return False
+
+        GLib.idle_add(prefetch_artists, priority=GLib.PRIORITY_LOW)
 
     def change_stack(self, widget, value):
         child_name = self.stack.get_visible_child_name()
@@ -392,16 +456,16 @@ class BaseInfoView(GObject.Object):
 
     def initialise(self, source, shell, plugin, stack, ds, view_name, view_image):
         self.stack = stack
+        self.source = source
 
-        self.webview = ArtistInfoWebView()
-        self.webview.initialise(source, shell)
+        # the webview is created when it's first needed
+        self._webview = None
 
         self.info_scrolled_window = Gtk.ScrolledWindow()
         self.info_scrolled_window.props.hexpand = True
         self.info_scrolled_window.props.vexpand = True
         self.info_scrolled_window.set_shadow_type(Gtk.ShadowType.IN)
         self.info_scrolled_window.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
-        self.info_scrolled_window.add(self.webview)
         self.info_scrolled_window.show_all()
         self.stack.add_named(self.info_scrolled_window, view_name)
 
@@ -429,6 +493,17 @@ class BaseInfoView(GObject.Object):
         self.load_tmpl()
         self.connect_signals()
 
+    @property
+    def webview(self):
+        if not self._webview:
+            self._webview = ArtistInfoWebView()
+            self._webview.initialise(self.source, self.shell)
+
+            self.info_scrolled_window.add(self._webview)
+            self._webview.show()
+
+        return self._webview
+
     def load_tmpl(self):
         pass
 
@@ -442,7 +517,8 @@ class BaseInfoView(GObject.Object):
         print("end load_view")
 
     def blank_view(self):
-        render_file = self.empty_template.render(stylesheet=self.styles)
+        render_file = render_template_cached(self.empty_template,
+                                             stylesheet=self.styles)
         self.webview.load_string(render_file, 'text/html', 'utf-8', self.basepath)
 
     def loading(self, current_artist, current_album_title):
@@ -473,7 +549,8 @@ class ArtistInfoView(BaseInfoView):
 
         self.link_ds.set_artist(current_artist)
         self.link_ds.set_album(current_album_title)
-        self.loading_file = self.loading_template.render(
+        self.loading_file = render_template_cached(
+            self.loading_template,
             artist=current_artist,
             info=_("Loading biography for %s") % current_artist,
             song="",
@@ -484,12 +561,9 @@ class ArtistInfoView(BaseInfoView):
         cl = CoverLocale()
         cl.switch_locale(cl.Locale.LOCALE_DOMAIN)
 
-        path = rb.find_plugin_file(self.plugin, 'tmpl/artist-tmpl.html')
-        empty_path = rb.find_plugin_file(self.plugin, 'tmpl/artist_empty-tmpl.html')
-        loading_path = rb.find_plugin_file(self.plugin, 'tmpl/loading.html')
-        self.template = Template(filename=path)
-        self.loading_template = Template(filename=loading_path)
-        self.empty_template = Template(filename=empty_path)
+        self.template = get_template(self.plugin, 'artist-tmpl.html')
+        self.loading_template = get_template(self.plugin, 'loading.html')
+        self.empty_template = get_template(self.plugin, 'artist_empty-tmpl.html')
         self.styles = self.basepath + '/tmpl/artistmain.css'
 
     def connect_signals(self):
@@ -526,7 +600,7 @@ class ArtistInfoView(BaseInfoView):
                                          art_links=self.link_ds.get_artist_links(),
                                          alb_links=links,
                                          link_images=self.link_images,
-                                         similar=ds.get_similar_info())
+                                         similar=ds.get_current_similar_info())
         self.load_view()
         #except Exception as e:
         #    print("Problem in info ready: %s" % e)
@@ -566,44 +640,38 @@ class ArtistDataSource(GObject.GObject):
         GObject.GObject.__init__(self)
 
         self.current_artist = None
+        self.current_info = self.empty_info()
+        self.generation = 0
         self.error = None
         cl = CoverLocale()
         lang = cl.get_locale()[:2]
+        self.lang = lang
+
+        # parsed information of the last artists, by artist and language
+        self.info = LRUCache(INFO_CACHE_SIZE)
 
         self.artist = {
             'info_en': {
-                'data': None,
                 'function': 'getinfo',
                 'cache': info_cache,
-                'signal': 'artist-info-ready',
-                'parsed': False,
                 'lang': 'en'
             },
             'similar_en': {
-                'data': None,
                 'function': 'getsimilar',
                 'cache': info_cache,
-                'signal': 'artist-info-ready',
-                'parsed': False,
                 'lang': 'en'
             }
         }
 
         if lang != 'en':
             self.artist['info_' + lang] = {
-                'data': None,
                 'function': 'getinfo',
                 'cache': info_cache,
-                'signal': 'artist-info-ready',
-                'parsed': False,
                 'lang': lang
             }
             self.artist['similar_' + lang] = {
-                'data': None,
                 'function': 'getsimilar',
                 'cache': info_cache,
-                'signal': 'artist-info-ready',
-                'parsed': False,
                 'lang': lang
             }
 
@@ -615,40 +683,104 @@ class ArtistDataSource(GObject.GObject):
         before any of the get_* methods.
         """
         self.current_artist = artist
+        # responses of previous fetches are discarded
+        self.generation += 1
+
         if LastFM.user_has_account() is False:
             self.error = LASTFM_NO_ACCOUNT_ERROR
+            self.current_info = self.empty_info()
             self.emit('artist-info-ready')
             return
 
         self.error = None
-        artist = urllib.parse.quote_plus(artist)
-        self.fetched = 0
+
+        info = self.info.get((artist, self.lang))
+        if info:
+            # already parsed, no need to ask the url cache
+            self.current_info = info
+            self.emit('artist-info-ready')
+            return
+
+        self.fetch(artist, self.artist_data_ready, self.generation)
+
+    def prefetch(self, artist):
+        """
+        Fetches and parses the artist data in the background, so it's ready
+        when the artist is selected.
+        """
+        if artist and (artist, self.lang) not in self.info and \
+                not artist_exceptions(artist) and LastFM.user_has_account():
+            self.fetch(artist, lambda *args: None)
+
+    def fetch(self, artist, callback, generation=None):
+        request = {'artist': artist,
+                   'data': {},
+                   'pending': len(self.artist),
+                   'callback': callback,
+                   'generation': generation}
+
+        qartist = urllib.parse.quote_plus(artist)
         for key, value in self.artist.items():
             print("search")
-            cachekey = "lastfm:artist:%sjson:%s:%s" % (value['function'], artist, value['lang'])
+            cachekey = "lastfm:artist:%sjson:%s:%s" % (value['function'], qartist, value['lang'])
             url = '%s?method=artist.%s&artist=%s&limit=10&api_key=%s&format=json&lang=%s' % (LastFM.API_URL,
-                                                                                             value['function'], artist,
+                                                                                             value['function'], qartist,
                                                                                              LastFM.API_KEY,
                                                                                              value['lang'])
             print("fetching %s" % url)
-            value['cache'].fetch(cachekey, url, self.fetch_artist_data_cb, value)
+            value['cache'].fetch(cachekey, url, self.fetch_artist_data_cb, key,
+                                 request)
+
+    def fetch_artist_data_cb(self, data, key, request):
+        request['pending'] -= 1
+
+        if request['generation'] not in (None, self.generation):
+            # the selection changed, don't even bother parsing it (the data
+            # is fine, returning False would make the cache throw it away)
+            return True
 
-    def fetch_artist_data_cb(self, data, category):
         if data is None:
-            print("no data fetched for artist %s" % category['function'])
+            print("no data fetched for artist %s" % key)
+        else:
+            try:
+                request['data'][key] = json.loads(data.decode('utf-8'))
+            except Exception as e:
+                print("Error parsing artist %s: %s" % (key, e))
+
+        if request['pending'] > 0:
             return
 
-        print(category)
-        try:
-            category['data'] = json.loads(data.decode('utf-8'))
-            category['parsed'] = False
-            self.fetched += 1
-            if self.fetched == len(self.artist):
-                self.emit(category['signal'])
+        info = self.parse_artist_data(request['data'])
+
+        if len(request['data']) == len(self.artist):
+            # only keep complete information, so what's missing is retried
+            self.info.put((request['artist'], self.lang), info)
+
+        request['callback'](request['artist'], info)
+
+    def artist_data_ready(self, artist, info):
+        if artist == self.current_artist:
+            self.current_info = info
+            self.emit('artist-info-ready')
+
+    def empty_info(self):
+        return {'images': None, 'bio': None, 'similar': ""}
 
+    def parse_artist_data(self, data):
+        """
+        Extracts from the artist data the information shown to the user.
+        """
+        info = self.empty_info()
+
+        try:
+            info['images'] = self.get_artist_images(data)
+            info['bio'] = self.get_artist_bio(data)
         except Exception as e:
-            print("Error parsing artist %s: %s" % (category['function'], e))
-            return False
+            print("Error parsing artist info: %s" % e)
+
+        info['similar'] = self.get_similar_info(data)
+
+        return info
 
     def get_current_artist(self):
         return self.current_artist
@@ -656,103 +788,74 @@ class ArtistDataSource(GObject.GObject):
     def get_error(self):
         return self.error
 
-    def get_artist_images(self):
+    def get_artist_images(self, data):
         """
         Returns tuple of image url's for small, medium, and large images.
         """
         print('get_artist_images')
-        data = self.artist['info_en']['data']
-        if data is None:
+        info = data.get('info_en')
+        if info is None:
             return None
 
-        if 'artist' not in data:
+        if 'artist' not in info:
             return None
 
-        print(list(data.keys()))
-        images = [img['#text'] for img in data['artist'].get('image', ())]
+        images = [img['#text'] for img in info['artist'].get('image', ())]
         return images[:3]
 
-    def get_artist_bio(self):
+    def get_artist_bio(self, data):
         """
         Returns tuple of summary and full bio
         """
-        cl = CoverLocale()
-        lang = cl.get_locale()[:2]
 
         def get_bio(lang):
-            data = self.artist['info_' + lang]['data']
-            if data is None:
+            info = data.get('info_' + lang)
+            if info is None or 'artist' not in info:
                 return None
 
-            if not self.artist['info_' + lang]['parsed']:
-                content = data['artist']['bio']['content']
-                summary = data['artist']['bio']['summary']
-                return summary, content
+            content = info['artist']['bio']['content']
+            summary = info['artist']['bio']['summary']
+            return summary, content
 
-            if lang != 'en':
-                return None
-            else:
-                return self.artist['info_' + lang]['data']['bio']
-
-
-        arg = get_bio(lang)
+        arg = get_bio(self.lang)
         if not arg or arg[0] == '':
             arg = get_bio('en')
 
         return arg
 
-    def get_similar_info(self):
+    def get_similar_info(self, data):
         """
-        Returns the dictionary { 'images', 'bio' }
+        Returns a list of dictionaries { 'name', 'image_url', 'similarity' }
         """
-        cl = CoverLocale()
-        lang = cl.get_locale()[:2]
-
         try:
-            if not self.artist['similar_' + lang]['parsed']:
-                json_artists_data = self.artist['similar_' + lang]['data']['similarartists']
+            json_artists_data = data['similar_' + self.lang]['similarartists']
 
-                results = []
-                print(json_artists_data)
-                for json_artist in json_artists_data["artist"]:
-                    print(json_artist)
-                    name = json_artist["name"]
-                    image_url = json_artist["image"][1]["#text"]
-                    similarity = int(100 * float(json_artist["match"]))
+            results = []
+            for json_artist in json_artists_data["artist"]:
+                name = json_artist["name"]
+                image_url = json_artist["image"][1]["#text"]
+                similarity = int(100 * float(json_artist["match"]))
 
-                    results.append({'name': name,
-                                    'image_url': image_url,
-                                    'similarity': similarity})
+                results.append({'name': name,
+                                'image_url': image_url,
+                                'similarity': similarity})
 
-                self.artist['similar_' + lang]['data'] = results
-                self.artist['similar_' + lang]['parsed'] = True
-
-            return self.artist['similar_' + lang]['data']
+            return results
         except Exception as e:
             print("Error parsing similar_infot: %s" % e)
             return ""
 
-
     def get_artist_info(self):
         """
         Returns the dictionary { 'images', 'bio' }
         """
-        cl = CoverLocale()
-        lang = cl.get_locale()[:2]
-
-        images = self.get_artist_images()
+        return self.current_info
 
-        def fill_info(lang):
-            if not self.artist['info_' + lang]['parsed']:
-                bio = self.get_artist_bio()
-                self.artist['info_' + lang]['data'] = {'images': images,
-                                                       'bio': bio}
-                self.artist['info_' + lang]['parsed'] = True
-
-            return self.artist['info_' + lang]['data']
-
-        fill_info('en')
-        return fill_info(lang)
+    def get_current_similar_info(self):
+        """
+        Returns the similar artists of the current artist.
+        """
+        return self.current_info['similar']
 
 
 class LinksDataSource(GObject.GObject):
@@ -839,7 +942,8 @@ class AlbumInfoView(BaseInfoView):
         cl = CoverLocale()
         # cl.switch_locale(cl.Locale.LOCALE_DOMAIN)
 
-        self.loading_file = self.loading_template.render(
+        self.loading_file = render_template_cached(
+            self.loading_template,
             artist=current_artist,
             # Translators: 'top' here means 'most popular'.  %s is replaced by the artist name.
             info=_("Loading top albums for %s") % current_artist,
@@ -851,12 +955,9 @@ class AlbumInfoView(BaseInfoView):
         cl = CoverLocale()
         # cl.switch_locale(cl.Locale.LOCALE_DOMAIN)
 
-        path = rb.find_plugin_file(self.plugin, 'tmpl/album-tmpl.html')
-        empty_path = rb.find_plugin_file(self.plugin, 'tmpl/album_empty-tmpl.html')
-        self.loading_path = rb.find_plugin_file(self.plugin, 'tmpl/loading.html')
-        self.album_template = Template(filename=path)
-        self.loading_template = Template(filename=self.loading_path)
-        self.empty_template = Template(filename=empty_path)
+        self.album_template = get_template(self.plugin, 'album-tmpl.html')
+        self.loading_template = get_template(self.plugin, 'loading.html')
+        self.empty_template = get_template(self.plugin, 'album_empty-tmpl.html')
         self.styles = self.basepath + '/tmpl/artistmain.css'
 
     def album_list_ready(self, ds):
@@ -891,6 +992,64 @@ class AlbumInfoView(BaseInfoView):
         self.artist = artist
 
 
+def parse_album_list(data, max_albums):
+    """
+    Decodes the top albums of an artist. Returns a tuple with the error
+    returned by last.fm (if any) and a list with the title and images of
+    each album.
+    """
+    parsed = json.loads(data.decode("utf-8"))
+
+    error = parsed.get('error')
+    if error:
+        return error, []
+
+    try:
+        top_albums = parsed['topalbums'].get('album', [])[:max_albums]
+    except:
+        top_albums = []
+
+    albums = []
+    for a in top_albums:
+        try:
+            images = [img['#text'] for img in a.get('image', [])]
+            albums.append({'title': a.get('name'), 'images': images[:3]})
+        except:
+            pass
+
+    return None, albums
+
+
+def parse_album_info(responses, lang):
+    """
+    Decodes the details (tracklist, wiki...) of an album from the responses
+    of last.fm in the user's language and in english.
+    """
+    details = {}
+
+    parsed = json.loads(responses[lang].decode('utf-8'))
+    details['id'] = parsed['album']['id']
+    for k in ('releasedate', 'summary'):
+        details[k] = parsed['album'].get(k)
+    tracklist = []
+    tracks = parsed['album']['tracks'].get('track', [])
+    for i, t in enumerate(tracks):
+        title = t['name']
+        duration = int(t['duration'])
+        tracklist.append((i, title, duration))
+    details['tracklist'] = tracklist
+    details['duration'] = sum([t[2] for t in tracklist])
+
+    if 'wiki' not in parsed['album'] and lang != 'en' and responses.get('en'):
+        parsed = json.loads(responses['en'].decode('utf-8'))
+
+    if 'wiki' in parsed['album']:
+        details['wiki-summary'] = parsed['album']['wiki']['summary']
+        details['wiki-content'] = parsed['album']['wiki']['content']
+
+    return details
+
+
 class AlbumDataSource(GObject.GObject):
     __gsignals__ = {
         'albums-ready': (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, ())
@@ -902,10 +1061,21 @@ class AlbumDataSource(GObject.GObject):
         self.error = None
         self.artist = None
         self.max_albums_fetched = 8
-        self.fetching = 0
+        self.generation = 0
         self.info_cache = info_cache
         self.ranking_cache = ranking_cache
 
+        cl = CoverLocale()
+        self.lang = cl.get_locale()[:2]
+
+        # parsed top albums of the last artists, by artist and language
+        self.info = LRUCache(INFO_CACHE_SIZE)
+        # parsed details of the last albums, by artist, album and language
+        self.details = LRUCache(INFO_CACHE_SIZE * self.max_albums_fetched)
+
+        # the responses are decoded off the main thread
+        self.pool = WorkerPool(2)
+
     def get_artist(self):
         return self.artist
 
@@ -918,129 +1088,177 @@ class AlbumDataSource(GObject.GObject):
             self.emit('albums-ready')
             return
 
-        cl = CoverLocale()
-        lang = cl.get_locale()[:2]
-
         self.artist = artist
-        qartist = urllib.parse.quote_plus(artist)
         self.error = None
+        # responses of previous fetches are discarded
+        self.generation += 1
+
+        albums = self.info.get((artist, self.lang))
+        if albums:
+            self.albums = albums
+            self.emit('albums-ready')
+            return
+
+        self.fetch(artist, self.albums_ready, self.generation)
+
+    def prefetch(self, artist):
+        """
+        Fetches and parses the artist's top albums in the background, so
+        they're ready when the artist is selected.
+        """
+        if artist and (artist, self.lang) not in self.info and \
+                not artist_exceptions(artist) and LastFM.user_has_account():
+            self.fetch(artist, lambda *args: None)
+
+    def fetch(self, artist, callback, generation=None):
+        qartist = urllib.parse.quote_plus(artist)
         url = "%s?method=artist.gettopalbums&artist=%s&api_key=%s&format=json&lang=%s" % (
-            LastFM.API_URL, qartist, LastFM.API_KEY, lang)
+            LastFM.API_URL, qartist, LastFM.API_KEY, self.lang)
         print(url)
         cachekey = 'lastfm:artist:gettopalbumsjson:%s' % qartist
-        self.ranking_cache.fetch(cachekey, url, self.parse_album_list, artist)
 
-    def parse_album_list(self, data, artist):
+        request = {'artist': artist,
+                   'albums': None,
+                   'error': None,
+                   'pending': 0,
+                   'callback': callback,
+                   'generation': generation,
+                   'cachekey': cachekey}
+
+        self.ranking_cache.fetch(cachekey, url, self.album_list_fetched,
+                                 request)
+
+    def is_stale(self, request):
+        return request['generation'] not in (None, self.generation)
+
+    def album_list_fetched(self, data, request):
+        # N.B. returning False tells the cache the data is invalid, so it's
+        # thrown away (and fetched again on a cache hit)
+        if self.is_stale(request):
+            # the selection changed, don't even bother parsing it
+            return True
+
         if data is None:
-            print("Nothing fetched for %s top albums" % artist)
+            print("Nothing fetched for %s top albums" % request['artist'])
             return False
 
-        try:
-            parsed = json.loads(data.decode("utf-8"))
-        except Exception as e:
-            print("Error parsing album list: %s" % e)
-            return False
+        self.pool.add_job(parse_album_list,
+                          lambda result, error: self.album_list_parsed(
+                              result, error, request),
+                          data, self.max_albums_fetched)
 
-        self.error = parsed.get('error')
-        if self.error:
-            self.emit('albums-ready')
-            return False
+        return True
 
-        try:
-            albums = parsed['topalbums'].get('album', [])[:self.max_albums_fetched]
-        except:
-            albums = []
+    def album_list_parsed(self, result, error, request):
+        if self.is_stale(request):
+            return
 
-        if len(albums) == 0:
-            self.error = "No albums found for %s" % artist
-            self.emit('albums-ready')
-            return True
-        print(albums)
-        self.albums = []
-        print("max number of albums to process")
-        print(len(albums))
-        # albums = parsed['topalbums'].get('album', [])[:self.max_albums_fetched]
-        self.fetching = len(albums)
-
-        for i, a in enumerate(albums):
-            try:
-                images = [img['#text'] for img in a.get('image', [])]
-                self.albums.append({'title': a.get('name'), 'images': images[:3]})
-                self.fetch_album_info(artist, a.get('name'), i)
-            except:
-                pass
+        if error:
+            # the cache accepted it before it was parsed
+            print("Error parsing album list: %s" % error)
+            discard_url_cache_entry(self.ranking_cache, request['cachekey'])
+            return
 
-        return True
+        request['error'], albums = result
+
+        if not request['error'] and not albums:
+            request['error'] = "No albums found for %s" % request['artist']
+
+        if request['error']:
+            request['callback'](request)
+            return
+
+        request['albums'] = albums
+        request['pending'] = len(albums)
+
+        # all the albums are fetched at the same time, each one joining its
+        # own responses
+        for album in albums:
+            self.fetch_album_info(request, album)
 
     def get_top_albums(self):
         return self.albums
 
-    def fetch_album_info(self, artist, album, index):
-        print('start fetch_album_info')
-        cl = CoverLocale()
-        lang = cl.get_locale()[:2]
-        qartist = urllib.parse.quote_plus(artist)
-        qalbum = urllib.parse.quote_plus(album)
-        self.fetched = 2
+    def fetch_album_info(self, request, album):
+        details = self.details.get(
+            (request['artist'], album['title'], self.lang))
+
+        if details:
+            album.update(details)
+            self.album_info_done(request)
+            return
+
+        qartist = urllib.parse.quote_plus(request['artist'])
+        qalbum = urllib.parse.quote_plus(album['title'])
 
-        def fetch_information(lang):
+        langs = set(['en', self.lang])
+        album_request = {'responses': {}, 'pending': len(langs),
+                         'cachekeys': []}
+
+        for lang in langs:
             cachekey = "lastfm:album:getinfojson:%s:%s:%s" % (qartist, qalbum, lang)
             url = "%s?method=album.getinfo&artist=%s&album=%s&api_key=%s&format=json&lang=%s" % (
                 LastFM.API_URL, qartist, qalbum, LastFM.API_KEY, lang)
             print(url)
 
-            self.info_cache.fetch(cachekey, url, self.parse_album_info, album, index, lang)
+            album_request['cachekeys'].append(cachekey)
+            self.info_cache.fetch(cachekey, url, self.album_info_fetched,
+                                  request, album, album_request, lang)
+
+    def album_info_fetched(self, data, request, album, album_request, lang):
+        if self.is_stale(request):
+            # the selection changed, don't even bother parsing it
+            return True
+
+        album_request['responses'][lang] = data
+        album_request['pending'] -= 1
 
-        self.album_data = {}
-        fetch_information('en')
-        fetch_information(lang)
-        print('end fetch_album_info')
+        if album_request['pending'] > 0:
+            return True
 
-    def parse_album_info(self, data, album, index, lang):
-        print('parse_album_info %s' % lang)
-        self.fetched = self.fetched - 1
-        self.album_data[lang] = data
-        if self.fetched > 0:
-            print('return %d' % self.fetched)
+        if album_request['responses'].get(self.lang) is None:
+            print("Nothing fetched for album %s" % album['title'])
+            self.album_info_done(request)
+            # the data of this response (if any) is fine
+            return True
+
+        self.pool.add_job(parse_album_info,
+                          lambda result, error: self.album_info_parsed(
+                              result, error, request, album,
+                              album_request),
+                          album_request['responses'], self.lang)
+
+        return True
+
+    def album_info_parsed(self, details, error, request, album,
+                          album_request):
+        if self.is_stale(request):
             return
 
-        cl = CoverLocale()
-        lang = cl.get_locale()[:2]
-        rv = True
-        try:
-            print('decoding')
-            parsed = json.loads(self.album_data[lang].decode('utf-8'))
-            print('decoded')
-            self.albums[index]['id'] = parsed['album']['id']
-            for k in ('releasedate', 'summary'):
-                self.albums[index][k] = parsed['album'].get(k)
-            tracklist = []
-            print(parsed['album'])
-            tracks = parsed['album']['tracks'].get('track', [])
-            for i, t in enumerate(tracks):
-                title = t['name']
-                duration = int(t['duration'])
-                tracklist.append((i, title, duration))
-            self.albums[index]['tracklist'] = tracklist
-            self.albums[index]['duration'] = sum([t[2] for t in tracklist])
-
-            if 'wiki' in parsed['album']:
-                self.albums[index]['wiki-summary'] = parsed['album']['wiki']['summary']
-                self.albums[index]['wiki-content'] = parsed['album']['wiki']['content']
-            elif lang != 'en':
-                parsed = json.loads(self.album_data['en'].decode('utf-8'))
-                if 'wiki' in parsed['album']:
-                    self.albums[index]['wiki-summary'] = parsed['album']['wiki']['summary']
-                    self.albums[index]['wiki-content'] = parsed['album']['wiki']['content']
-        except Exception as e:
-            print("Error parsing album tracklist: %s" % e)
-            rv = False
+        if error:
+            # the cache accepted the responses before they were parsed
+            print("Error parsing album tracklist: %s" % error)
+            for cachekey in album_request['cachekeys']:
+                discard_url_cache_entry(self.info_cache, cachekey)
+        else:
+            album.update(details)
+            self.details.put((request['artist'], album['title'], self.lang),
+                             details)
 
-        self.fetching -= 1
-        print("%s albums left to process" % self.fetching)
-        if self.fetching == 0:
-            self.emit('albums-ready')
-        return rv
+        self.album_info_done(request)
+
+    def album_info_done(self, request):
+        request['pending'] -= 1
+        print("%s albums left to process" % request['pending'])
+
+        if request['pending'] == 0:
+            self.info.put((request['artist'], self.lang), request['albums'])
+            request['callback'](request)
+
+    def albums_ready(self, request):
+        self.error = request['error']
+        self.albums = request['albums']
+        self.emit('albums-ready')
 
 
 class EchoArtistInfoView(BaseInfoView):
@@ -1057,12 +1275,9 @@ class EchoArtistInfoView(BaseInfoView):
         cl = CoverLocale()
         # cl.switch_locale(cl.Locale.LOCALE_DOMAIN)
 
-        path = rb.find_plugin_file(self.plugin, 'tmpl/echoartist-tmpl.html')
-        empty_path = rb.find_plugin_file(self.plugin, 'tmpl/artist_empty-tmpl.html')
-        loading_path = rb.find_plugin_file(self.plugin, 'tmpl/loading.html')
-        self.template = Template(filename=path)
-        self.loading_template = Template(filename=loading_path)
-        self.empty_template = Template(filename=empty_path)
+        self.template = get_template(self.plugin, 'echoartist-tmpl.html')
+        self.loading_template = get_template(self.plugin, 'loading.html')
+        self.empty_template = get_template(self.plugin, 'artist_empty-tmpl.html')
         self.styles = self.basepath + '/tmpl/artistmain.css'
         print(lastfm_datasource_link(self.basepath))
 
@@ -1138,6 +1353,7 @@ class EchoArtistDataSource(GObject.GObject):
 
         self.current_artist = None
         self.error = None
+        self.generation = 0
         self.artist = {
             'info': {
                 'data': None,
@@ -1155,6 +1371,8 @@ class EchoArtistDataSource(GObject.GObject):
         before any of the get_* methods.
         """
         self.current_artist = artist
+        # responses of previous fetches are discarded
+        self.generation += 1
 
         self.error = None
         artist = urllib.parse.quote_plus(artist)
@@ -1168,9 +1386,15 @@ class EchoArtistDataSource(GObject.GObject):
                                                                                              api_key, artist)
 
             print("fetching %s" % url)
-            value['cache'].fetch(cachekey, url, self.fetch_artist_data_cb, value)
+            value['cache'].fetch(cachekey, url, self.fetch_artist_data_cb, value,
+                                 self.generation)
+
+    def fetch_artist_data_cb(self, data, category, generation):
+        if generation != self.generation:
+            # the selection changed, don't even bother parsing it (the data
+            # is fine, returning False would make the cache throw it away)
+            return True
 
-    def fetch_artist_data_cb(self, data, category):
         if data is None:
             print("no data fetched for artist")
             return
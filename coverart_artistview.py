@@ -31,10 +31,10 @@ from gi.repository import RB
 
 from coverart_browser_prefs import GSetting
 from coverart_album import Album
-from coverart_album import AlbumsModel
 from coverart_album import CoverManager
 from coverart_widgets import AbstractView
 from coverart_utils import SortedCollection
+from coverart_utils import NaturalString
 from coverart_widgets import PanedCollapsible
 from coverart_toolbar import ToolbarObject
 from coverart_utils import idle_iterator
@@ -56,6 +56,13 @@ def create_temporary_copy(path):
 
 ARTIST_LOAD_CHUNK = 50
 
+# album properties used to sort the albums of an artist
+ALBUM_SORT_KEYS = {
+    'name_artist': ('album_sort', 'album_sort'),
+    'year_artist': ('real_year', 'calc_year_sort'),
+    'rating_artist': ('rating', 'album_sort')
+}
+
 
 class Artist(GObject.Object):
     '''
@@ -81,6 +88,9 @@ class Artist(GObject.Object):
         self._cover = None
         self.cover = cover
 
+        # folded natural key used to order the artists
+        self.sort_key = (NaturalString(RB.search_fold(name)), name)
+
         self._signals_id = {}
 
     @property
@@ -137,8 +147,14 @@ class ArtistsModel(GObject.Object):
         self.album_manager = album_manager
         self._iters = {}
         self._albumiters = {}
+        self._artist_albums = {}
+        # handler ids of the albums' 'emptied' signal, by album
+        self._emptied_ids = {}
+        self._visible_albums = {}
+        self._read_sort_settings()
         self._artists = SortedCollection(
-            key=lambda artist: getattr(artist, 'name'))
+            key=lambda artist: getattr(artist, 'sort_key'))
+        self._ascending = True
 
         self._tree_store = Gtk.TreeStore(str, GdkPixbuf.Pixbuf, object,
                                          bool, str, str, str)
@@ -146,49 +162,96 @@ class ArtistsModel(GObject.Object):
         # sorting idle call
         self._sort_process = None
 
-        # create the filtered store that's used with the view
+        # create the filtered store that's used with the view; artists are
+        # kept in order in the tree store itself so there's no need to sort it
         self._filtered_store = self._tree_store.filter_new()
         self._filtered_store.set_visible_column(ArtistsModel.columns['show'])
 
-        self._tree_sort = Gtk.TreeModelSort(model=self._filtered_store)
-        # self._tree_sort.set_default_sort_func(lambda *unused: 0)
-        self._tree_sort.set_sort_func(0, self._compare, None)
-
         self._connect_signals()
 
     def _connect_signals(self):
         self.connect('update-path', self._on_update_path)
-        self.album_manager.model.connect('filter-changed', self._on_album_filter_changed)
+        self.album_manager.model.connect('album-added', self._on_album_added)
+        self.album_manager.model.connect('visibility-changed',
+                                         self._on_album_visibility_changed)
 
-    def _on_album_filter_changed(self, *args):
-        if len(self._iters) == 0:
-            return
+        # index and count the albums already loaded for each artist
+        album_model = self.album_manager.model
+        for album in album_model.get_all():
+            self._index_album(album)
+
+            if album_model.is_visible(album):
+                self._on_album_visibility_changed(album_model, album, True)
+
+    def _index_album(self, album):
+        if album.artist not in self._artist_albums:
+            self._artist_albums[album.artist] = set()
+
+        self._artist_albums[album.artist].add(album)
+
+        if album not in self._emptied_ids:
+            self._emptied_ids[album] = album.connect('emptied',
+                                                     self._unindex_album)
+
+    def _unindex_album(self, album):
+        handler_id = self._emptied_ids.pop(album, None)
+
+        if handler_id is not None:
+            album.disconnect(handler_id)
 
-        artists = list(set(row[AlbumsModel.columns['album']].artist for row in self.album_manager.model.store))
+        albums = self._artist_albums.get(album.artist)
 
-        for artist in self._iters:
-            self.show(artist, artist in artists)
+        if albums is not None:
+            albums.discard(album)
 
-    def _compare(self, model, row1, row2, user_data):
+            if not albums:
+                del self._artist_albums[album.artist]
 
-        if not model.iter_has_child(row1) or \
-                not model.iter_has_child(row2):
-            return 0
+    def _on_album_added(self, album_model, album):
+        self._index_album(album)
+
+        # artists already expanded get their new album straight away; the
+        # rest will pick it up from the index when they are expanded
+        if album.artist in self._iters and \
+                'dummy_iter' not in self._iters[album.artist]:
+            self.add_album_to_artist(self.get(album.artist), [album])
+
+    def _on_album_visibility_changed(self, album_model, album, visible):
+        '''
+        Keeps count of the visible albums of each artist, showing or hiding
+        the artist only when its first album appears or its last one goes.
+        '''
+        count = self._visible_albums.get(album.artist, 0)
+        count += 1 if visible else -1
 
-        sort_column = 0
-        value1 = RB.search_fold(model.get_value(row1, sort_column))
-        value2 = RB.search_fold(model.get_value(row2, sort_column))
-        if value1 < value2:
-            return -1
-        elif value1 == value2:
-            return 0
+        if count > 0:
+            self._visible_albums[album.artist] = count
         else:
-            return 1
+            self._visible_albums.pop(album.artist, None)
+
+        if (visible and count == 1) or (not visible and count == 0):
+            if album.artist in self._iters:
+                self.show(album.artist, visible)
 
     @property
     def store(self):
-        # return self._filtered_store
-        return self._tree_sort
+        return self._filtered_store
+
+    def set_sort_order(self, ascending):
+        '''
+        Changes the order in which the artists are shown.
+
+        :param ascending: `bool` indicating whether the artists should be
+            sorted in ascending(True) or descending(False) order.
+        '''
+        if ascending == self._ascending:
+            return
+
+        self._ascending = ascending
+
+        # reverse all the artist rows in one go
+        self._tree_store.reorder(None,
+                                 list(reversed(range(len(self._artists)))))
 
     def add(self, artist):
         '''
@@ -200,6 +263,9 @@ class ArtistsModel(GObject.Object):
         values = self._generate_artist_values(artist)
         # insert the values
         pos = self._artists.insert(artist)
+        if not self._ascending:
+            pos = len(self._artists) - 1 - pos
+
         tree_iter = self._tree_store.insert(None, pos, values)
         child_iter = self._tree_store.insert(tree_iter, pos, values)  # dummy child row so that the expand is available
         # connect signals
@@ -249,7 +315,7 @@ class ArtistsModel(GObject.Object):
            called when update-path signal is called
         '''
         artist = self.get_from_path(treepath)
-        albums = self.album_manager.model.get_all()
+        albums = self._artist_albums.get(artist.name, ())
         self.add_album_to_artist(artist, albums)
 
     def add_album_to_artist(self, artist, albums):
@@ -292,7 +358,7 @@ class ArtistsModel(GObject.Object):
             self._tree_store.remove(self._iters[artist.name]['dummy_iter'])
             del self._iters[artist.name]['dummy_iter']
 
-        self.sort()  # ensure the added albums are sorted correctly
+        self.sort(artist.name)  # ensure the added albums are sorted correctly
 
     def _album_modified(self, album):
         print("album modified")
@@ -312,7 +378,7 @@ class ArtistsModel(GObject.Object):
             self._tree_store.set(tree_iter, self.columns['tooltip'], tooltip,
                                  self.columns['markup'], markup, self.columns['show'], show)
 
-            self.sort()  # ensure the added albums are sorted correctly
+            self.sort(album.artist)  # ensure the albums are still sorted correctly
 
     def _album_emptied(self, album):
         '''
@@ -342,7 +408,6 @@ class ArtistsModel(GObject.Object):
         # test if there are any more albums for this artist otherwise just cleanup
         if len(self._iters[album.artist]['album']) == 0:
             self.remove(artist)
-            self._on_album_filter_changed(_)
 
     def _album_coverupdate(self, album):
         tooltip, pixbuf, album, show, blank, markup, empty = self._generate_album_values(album)
@@ -352,7 +417,7 @@ class ArtistsModel(GObject.Object):
     def _generate_artist_values(self, artist):
         tooltip = artist.name
         pixbuf = artist.cover.pixbuf
-        show = True
+        show = artist.name in self._visible_albums
 
         return tooltip, pixbuf, artist, show, '', \
                GLib.markup_escape_text(tooltip), ''
@@ -460,7 +525,7 @@ class ArtistsModel(GObject.Object):
 
     def get_from_path(self, path):
         '''
-        Returns the Artist or Album referenced by a `Gtk.TreeModelSort` path.
+        Returns the Artist or Album referenced by a `Gtk.TreeModelFilter` path.
 
         :param path: `Gtk.TreePath` referencing the artist.
         '''
@@ -496,66 +561,67 @@ class ArtistsModel(GObject.Object):
         '''
         artist_iter = self._iters[artist_name]['iter']
 
-        if self._tree_store.iter_is_valid(artist_iter):
+        if self._tree_store.iter_is_valid(artist_iter) and \
+                self._tree_store[artist_iter][self.columns['show']] != show:
             self._tree_store.set_value(artist_iter, self.columns['show'], show)
 
 
-    def sort(self):
-
-        albums = SortedCollection(key=lambda album: getattr(album, 'name'))
-
+    def _read_sort_settings(self):
+        '''
+        Reads how the albums of each artist are to be sorted.
+        '''
         gs = GSetting()
         source_settings = gs.get_setting(gs.Path.PLUGIN)
         key = source_settings[gs.PluginKey.SORT_BY_ARTIST]
-        order = source_settings[gs.PluginKey.SORT_ORDER_ARTIST]
-
-        sort_keys = {
-            'name_artist': ('album_sort', 'album_sort'),
-            'year_artist': ('real_year', 'calc_year_sort'),
-            'rating_artist': ('rating', 'album_sort')
-        }
 
-        props = sort_keys[key]
+        self._album_sort_props = ALBUM_SORT_KEYS[key]
+        self._album_sort_ascending = \
+            source_settings[gs.PluginKey.SORT_ORDER_ARTIST]
 
-        def key_function(album):
-            keys = [getattr(album, prop) for prop in props]
-            return keys
+    def _sort_albums(self, artist_name):
+        '''
+        Reorders the album rows of an artist in a single step.
+        '''
+        if len(self._iters[artist_name].get('album', [])) < 2:
+            # we only need to sort an artists albums if there is more than one album
+            return
 
-        # remember the current sort then remove the sort order
-        # because sorting will only work in unsorted lists
-        sortSettings = self.store.get_sort_column_id()
+        artist_iter = self._iters[artist_name]['iter']
+        column = self.columns['artist_album']
 
-        self.store.set_sort_column_id(-1, Gtk.SortType.ASCENDING)
+        albums = []
+        child_iter = self._tree_store.iter_children(artist_iter)
 
-        for artist in self._iters:
-            albums.clear()
-            albums.key = key_function
+        while child_iter is not None:
+            albums.append(self._tree_store[child_iter][column])
+            child_iter = self._tree_store.iter_next(child_iter)
 
-            if 'album' in self._iters[artist] and len(self._iters[artist]['album']) > 1:
-                # we only need to sort an artists albums if there is more than one album
+        props = self._album_sort_props
 
-                # sort all the artists albums
-                for album_iter in self._iters[artist]['album']:
-                    albums.insert(self._tree_store[album_iter][self.columns['artist_album']])
+        def key_function(position):
+            return [getattr(albums[position], prop) for prop in props]
 
-                if not order:
-                    albums = reversed(albums)
+        # new_order[new position] = old position
+        new_order = sorted(range(len(albums)), key=key_function,
+                           reverse=not self._album_sort_ascending)
 
-                # now we iterate through the sorted artist albums.  Look and swap iters
-                # according to where they are in the tree store
+        if new_order != list(range(len(albums))):
+            self._tree_store.reorder(artist_iter, new_order)
 
-                artist_iter = self._iters[artist]['iter']
-                next_iter = self._tree_store.iter_children(artist_iter)
+    def sort(self, artist_name=None):
+        '''
+        Sorts the albums of the given artist. If no artist is given the sort
+        settings are reread and the albums of every artist are sorted.
 
-                for album in albums:
-                    if self._tree_store[next_iter][self.columns['artist_album']] != album:
-                        self._tree_store.swap(next_iter, self._albumiters[album]['iter'])
-                        next_iter = self._albumiters[album]['iter']
-                    next_iter = self._tree_store.iter_next(next_iter)
+        :param artist_name: `str` name of the artist whose albums to sort.
+        '''
+        if artist_name is None:
+            self._read_sort_settings()
 
-        # now we have finished sorting, reapply the sort
-        if sortSettings[0]:
-            self.store.set_sort_column_id(*sortSettings)
+            for artist in self._iters:
+                self._sort_albums(artist)
+        elif artist_name in self._iters:
+            self._sort_albums(artist_name)
 
 
 class ArtistCellRenderer(Gtk.CellRendererPixbuf):
@@ -665,11 +731,8 @@ class ArtistLoader(GObject.Object):
           called when album-manager album-added signal is invoked
         '''
         print(album.artist)
-        if self._artist_manager.model.contains(album.artist):
-            print("contains artist")
-            artist = self._artist_manager.model.get(album.artist)
-            self._artist_manager.model.add_album_to_artist(artist, [album])
-        else:
+        if not self._artist_manager.model.contains(album.artist):
+            # albums of known artists are taken care of by the model
             print("new artist")
             artist = Artist(album.artist, self._artist_manager.cover_man.unknown_cover)
             self._artist_manager.model.add(artist)
@@ -824,17 +887,20 @@ class ArtistView(Gtk.TreeView, AbstractView):
         col = Gtk.TreeViewColumn(_('Artist'), Gtk.CellRendererText(), markup=5)
         self._artist_col = col
         col.set_clickable(True)
-        col.set_sort_column_id(0)
         col.set_sort_indicator(True)
+        col.set_sort_order(Gtk.SortType.ASCENDING)
         col.connect('clicked', self._artist_sort_clicked)
         self.append_column(col)
         col = Gtk.TreeViewColumn('', Gtk.CellRendererText(), text=4)
         self.append_column(col)  # dummy column to expand horizontally
 
         self.artist_manager = self.album_manager.artist_man
-        self.artist_manager.model.store.set_sort_column_id(0, Gtk.SortType.ASCENDING)
         self.set_model(self.artist_manager.model.store)
 
+        self.artist_manager.cover_man.connect('load-finished',
+                                              source.resume_cover_search,
+                                              self.artist_manager)
+
         # setup iconview drag&drop support
         # first drag and drop on the coverart view to receive coverart
         self.enable_model_drag_dest([], Gdk.DragAction.COPY)
@@ -886,17 +952,20 @@ class ArtistView(Gtk.TreeView, AbstractView):
         self.connect('query-tooltip', self._query_tooltip)
 
     def _artist_sort_clicked(self, *args):
-        # in the absence of an apparent way to remove the unsorted default_sort_func
-        # find out if we are now in an unsorted state - if we are
-        # throw another clicked event so that we remain sorted.
-        value, order = self.artist_manager.model.store.get_sort_column_id()
+        # the artists are kept sorted by the model, so clicking the column
+        # just flips the order
+        if self._artist_col.get_sort_order() == Gtk.SortType.ASCENDING:
+            order = Gtk.SortType.DESCENDING
+        else:
+            order = Gtk.SortType.ASCENDING
 
-        if order == None:
-            self._artist_col.emit('clicked')
+        self._artist_col.set_sort_order(order)
+        self.artist_manager.model.set_sort_order(
+            order == Gtk.SortType.ASCENDING)
 
     def cover_search_menu_item_callback(self, *args):
         self.artist_manager.cover_man.search_covers(self.get_selected_objects(just_artist=True),
-                                                    callback=self.source.update_request_status_bar)
+                                                    callback=self.source.update_request_progress)
 
     def _query_tooltip(self, widget, x, y, key, tooltip):
 
@@ -33,6 +33,7 @@ from coverart_browser_source import CoverArtBrowserSource
 from coverart_listview import ListView
 from coverart_queueview import QueueView
 from coverart_toolbar import TopToolbar
+from coverart_playlists import ArtistEntriesIndex
 
 
 class CoverArtBrowserEntryType(RB.RhythmDBEntryType):
@@ -118,6 +119,7 @@ class CoverArtBrowserPlugin(GObject.Object, Peas.Activatable):
         self.source.delete_thyself()
         if self._externalmenu:
             self._externalmenu.cleanup()
+        ArtistEntriesIndex.destroy_instance()
         del self.shell
         del self.db
         del self.source
@@ -165,6 +165,9 @@ class GSetting:
                 FLOW_AUTOMATIC='flow-automatic',
                 FLOW_WIDTH='flow-width',
                 FLOW_MAX='flow-max-albums',
+                COVER_SEARCH_REQUESTS='cover-search-requests',
+                COVER_SEARCH_RETRY='cover-search-retry-days',
+                COVER_MAX_SIZE='cover-max-size',
                 WEBKIT='webkit-support',
                 ARTIST_PANED_POSITION='artist-paned-pos',
                 USE_FAVOURITES='use-favourites',
@@ -83,6 +83,7 @@ class CoverArtBrowserSource(RB.Source):
         self.favourites = False
         self.follow_song = False
         self.task_progress = None
+        self.exporter = None
         self._from_paned_handle = 0
 
     def _connect_properties(self):
@@ -111,10 +112,20 @@ class CoverArtBrowserSource(RB.Source):
 
         if not self.task_progress:
             self.task_progress = RB.TaskProgressSimple.new()
+            self.task_progress.connect('cancel-task', self._cancel_task)
 
         try:
             progress = self.album_manager.progress
-            progress_text = _('Loading...') if progress < 1 else ''
+            exporting = self.exporter and self.exporter.running
+
+            if progress >= 1:
+                progress_text = ''
+            elif exporting:
+                progress_text = _('Exporting...')
+            else:
+                progress_text = _('Loading...')
+
+            self.task_progress.props.task_cancellable = bool(exporting)
 
             if progress < 1:
                 if self.props.shell.props.task_list.get_model().n_items() == 0:
@@ -133,6 +144,10 @@ class CoverArtBrowserSource(RB.Source):
 
         return (self.status, progress_text, progress)
 
+    def _cancel_task(self, *args):
+        if self.exporter:
+            self.exporter.cancel()
+
     def do_selected(self):
         '''
         Called by Rhythmbox when the source is selected. It makes sure to
@@ -270,6 +285,7 @@ class CoverArtBrowserSource(RB.Source):
         self.request_status_box = ui.get_object('request_status_box')
         self.request_spinner = ui.get_object('request_spinner')
         self.request_statusbar = ui.get_object('request_statusbar')
+        self.request_progressbar = ui.get_object('request_progressbar')
         self.request_cancel_button = ui.get_object('request_cancel_button')
         self.paned = ui.get_object('paned')
         self.paned.set_name('horizontal_paned')
@@ -344,6 +360,11 @@ class CoverArtBrowserSource(RB.Source):
         self.load_fin_id = self.album_manager.loader.connect(
             'model-load-finished', self.load_finished_callback)
 
+        # resume any cover search left unfinished once the covers are loaded
+        self.album_manager.cover_man.connect('load-finished',
+                                             self.resume_cover_search,
+                                             self.album_manager)
+
         # prompt the loader to load the albums
         self.album_manager.loader.load_albums(self.props.base_query_model)
 
@@ -943,8 +964,9 @@ class CoverArtBrowserSource(RB.Source):
 
         self.request_status_box.show_all()
 
+        self._cover_search_manager = self.album_manager
         self.album_manager.cover_man.search_covers(selected_albums,
-                                                   self.update_request_status_bar)
+                                                   self.update_request_progress)
 
         print("CoverArtBrowser DEBUG - end cover_search_menu_item_callback()")
 
@@ -957,29 +979,58 @@ class CoverArtBrowserSource(RB.Source):
         print("CoverArtBrowser DEBUG - export_embed_menu_item_callback()")
         selected_albums = self.viewmgr.current_view.get_selected_objects()
 
-        CoverArtExport(self.plugin,
-                       self.shell, self.album_manager).embed_albums(selected_albums)
+        if self.exporter and self.exporter.running:
+            # only one export at a time
+            return
+
+        self.exporter = CoverArtExport(self.plugin,
+                                       self.shell, self.album_manager)
+        self.exporter.embed_albums(selected_albums)
 
         print("CoverArtBrowser DEBUG - export_embed_menu_item_callback()")
 
-    def update_request_status_bar(self, coverobject):
+    def update_request_progress(self, requester):
         '''
-        Callback called by the album loader starts performing a new cover
-        request. It prompts the source to change the content of the request
-        statusbar.
+        Callback called periodically by the cover requester while it performs
+        cover requests. It prompts the source to update the content of the
+        request statusbar and progress bar.
         '''
-        print("CoverArtBrowser DEBUG - update_request_status_bar")
+        print("CoverArtBrowser DEBUG - update_request_progress")
+
+        if requester:
+            searching = requester.searching
+
+            if len(searching) == 1:
+                text = _('Requesting cover for %s...') % searching[0].name
+            else:
+                text = _('Requesting covers: %d of %d') % (
+                    requester.searched + len(searching), requester.total)
 
-        if coverobject:
-            # for example "Requesting the picture cover for the music artist Michael Jackson"
-            tranlation_string = _('Requesting cover for %s...')
             self.request_statusbar.set_text(
-                rb3compat.unicodedecode(_('Requesting cover for %s...') % (coverobject.name), 'UTF-8'))
+                rb3compat.unicodedecode(text, 'UTF-8'))
+
+            if requester.total:
+                self.request_progressbar.set_fraction(
+                    float(requester.searched) / requester.total)
         else:
             self.request_status_box.hide()
+            self.request_progressbar.set_fraction(0)
             self.popup_menu.set_sensitive('cover_search_menu_item', True)
             self.request_cancel_button.set_sensitive(True)
-        print("CoverArtBrowser DEBUG - end update_request_status_bar")
+        print("CoverArtBrowser DEBUG - end update_request_progress")
+
+    def resume_cover_search(self, cover_man, manager):
+        '''
+        Callback called when a manager finishes loading its covers. It
+        resumes the cover search left unfinished on the last session.
+        '''
+        if self.request_status_box.get_visible():
+            # there is already a search going on
+            return
+
+        if cover_man.resume_cover_search(self.update_request_progress):
+            self._cover_search_manager = manager
+            self.request_status_box.show_all()
 
     def cancel_request_callback(self, _):
         '''
@@ -1036,7 +1087,7 @@ class CoverArtBrowserSource(RB.Source):
             self.request_status_box.show_all()
             self._cover_search_manager = self.viewmgr.current_view.get_default_manager()
             self._cover_search_manager.cover_man.search_covers(
-                callback=self.update_request_status_bar)
+                callback=self.update_request_progress)
         elif choice == 'random':
             self.play_random_album_menu_item_callback()
         elif choice == 'random favourite':
@@ -17,8 +17,10 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
 
+import hashlib
 import json
 import os
+import threading
 from xml.sax.saxutils import escape
 
 from gi.repository import Gdk
@@ -26,11 +28,15 @@ from gi.repository import Gtk
 from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gio
+from gi.repository import GdkPixbuf
+from gi.repository import RB
 
 from coverart_browser_prefs import GSetting
 from coverart_browser_prefs import webkit_support
 from coverart_widgets import AbstractView
 from coverart_widgets import PanedCollapsible
+from coverart_utils import WorkerPool
+from coverart_utils import LRUCache
 import rb
 
 
@@ -56,6 +62,120 @@ class FlowShowingPolicy(GObject.Object):
         self._model = album_manager.model
 
 
+class FlowThumbnails(object):
+    '''
+    Disk cache of pre-scaled covers for the flow, so the webview doesn't
+    have to decode full size images for the (much smaller) tiles.
+
+    Thumbnails are generated in the background; until a thumbnail is ready
+    the original image is used. Each original keeps its thumbnails on its own
+    folder, named after their size and the original's mtime, so a new
+    thumbnail replaces the previous one of the same size.
+    '''
+    # number of threads used to generate the thumbnails
+    WORKERS = 2
+
+    # thumbnail paths remembered
+    CACHE_SIZE = 1000
+
+    def __init__(self):
+        self._cache_dir = os.path.join(RB.user_cache_dir(), 'coverart_browser',
+                                       'flow')
+        self._thumbnails = LRUCache(self.CACHE_SIZE)
+        self._pending = set()
+        self._pool = WorkerPool(self.WORKERS)
+
+    def lookup(self, original, size, callback):
+        '''
+        Returns the thumbnail of `original` for the given `size`, or None if it
+        isn't available yet, in which case it's generated in the background
+        and `callback` is called with the original and the thumbnail path once
+        it's done.
+        '''
+        try:
+            # covers are replaced keeping the same path
+            mtime = os.path.getmtime(original)
+        except OSError:
+            return None
+
+        key = (original, mtime, size)
+
+        if key in self._thumbnails:
+            return self._thumbnails.get(key)
+
+        if key not in self._pending:
+            self._pending.add(key)
+
+            def generated(thumbnail, error):
+                self._pending.discard(key)
+
+                if error:
+                    # not remembered, so it's tried again next time
+                    print("Error while creating flow thumbnail: " + str(error))
+                    thumbnail = original
+                else:
+                    self._thumbnails.put(key, thumbnail)
+
+                callback(original, thumbnail)
+
+            self._pool.add_job(self._generate, generated, original, mtime,
+                               size)
+
+        return None
+
+    def cancel(self):
+        '''
+        Drops the thumbnails waiting to be generated.
+        '''
+        self._pool.cancel()
+        self._pending.clear()
+
+    def _generate(self, original, mtime, size):
+        # runs on a worker thread
+        folder = os.path.join(self._cache_dir, hashlib.sha1(
+            original.encode('utf-8')).hexdigest())
+        thumbnail = os.path.join(folder, '%d-%f' % (size, mtime))
+
+        if os.path.exists(thumbnail):
+            return thumbnail
+
+        info, width, height = GdkPixbuf.Pixbuf.get_file_info(original)
+
+        if width <= size and height <= size:
+            # the original is already small enough
+            return original
+
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(original, size, size)
+
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+
+        # write to a temp file first so a half written thumbnail is never used
+        temp = '%s.%d.tmp' % (thumbnail, threading.current_thread().ident)
+
+        if pixbuf.get_has_alpha():
+            pixbuf.savev(temp, 'png', [], [])
+        else:
+            pixbuf.savev(temp, 'jpeg', ['quality'], ['90'])
+
+        os.rename(temp, thumbnail)
+
+        # the thumbnails of the previous versions of the original aren't
+        # needed anymore
+        prefix = '%d-' % size
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.path != thumbnail and \
+                        entry.name.startswith(prefix) and \
+                        not entry.name.endswith('.tmp'):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+        return thumbnail
+
+
 class CoverFlowView(AbstractView):
     __gtype_name__ = "CoverFlowView"
 
@@ -150,19 +270,10 @@ class CoverFlowView(AbstractView):
 
         if self.flow_background == 'W':
             background_colour = 'white'
-            if len(self.album_manager.model.store) <= self.flow_max:
-                foreground_colour = 'white'
-            else:
-                foreground_colour = 'black'
         else:
             background_colour = 'black'
-            if len(self.album_manager.model.store) <= self.flow_max:
-                foreground_colour = 'black'
-            else:
-                foreground_colour = 'white'
 
         string = string.replace('#BACKGROUND_COLOUR', background_colour)
-        string = string.replace('#FOREGROUND_COLOUR', foreground_colour)
         string = string.replace('#FACTOR', str(float(self.flow_scale) / 100))
 
         if self.flow_hide:
@@ -184,21 +295,21 @@ class CoverFlowView(AbstractView):
 
         string = string.replace('#WIDTH', str(self.flow_width))
 
-        identifier = self.flow.get_identifier(self.last_album)
-        if not identifier:
-            identifier = "'start'"
-        else:
-            identifier = str(identifier)
-
-        string = string.replace('#START', identifier)
+        # the covers next to the centred one are at most half its size
+        thumbnail_size = int(self.flow_width * self.flow_scale / 100 / 2)
+        thumbnail_size = max(100, (thumbnail_size // 50 + 1) * 50)
 
-        #TRANSLATORS: for example 'Number of covers limited to 150'
-        display_message = _("Number of covers limited to %d") % self.flow_max
-        string = string.replace('#MAXCOVERS',
-                                '<p>' + display_message + '</p>')
+        items, start, circular = self.flow.initialise(self.album_manager.model,
+                                                      self.flow_max, thumbnail_size,
+                                                      self.last_album)
 
-        items = self.flow.initialise(self.album_manager.model, self.flow_max)
+        if start is None:
+            start = "'start'"
+        else:
+            start = str(start)
 
+        string = string.replace('#START', start)
+        string = string.replace('#CIRCULAR', 'true' if circular else 'false')
         string = string.replace('#ITEMS', items)
 
         base = os.path.dirname(path) + "/"
@@ -305,8 +416,8 @@ class CoverFlowView(AbstractView):
 
     def select_and_scroll_to_path(self, path):
         album = self.source.album_manager.model.get_from_path(path)
-        self.flow.scroll_to_album(album, self.view)
         self.item_clicked_callback(album)
+        self.scroll_to_album(album)
 
     def switch_to_view(self, source, album):
         self.initialise(source)
@@ -319,44 +430,149 @@ class CoverFlowView(AbstractView):
         self.view.grab_focus()
 
     def scroll_to_album(self, album):
-        self.flow.scroll_to_album(album, self.view)
+        if not self.flow.scroll_to_album(album, self.view):
+            # the album is outside the window of covers currently held by
+            # the page - reload the flow centred on it
+            self.filter_changed()
 
 
 class FlowControl(object):
+    '''
+    Feeds the albums of the `AlbumsModel` to the flow webview.
+
+    Only a window of `window_size` covers around the current position is held
+    by the page; neighbouring covers are streamed in and out as the user
+    scrolls through the flow.
+
+    Every album gets an identifier the first time it's shown on the flow and
+    keeps it for as long as it's part of the model, so identifiers remain
+    valid across filter changes.
+    '''
+
     def __init__(self, callback_view):
         self.callback_view = callback_view
         self.album_identifier = {}
+        self._identifiers = {}
+        self._next_identifier = 0
+        self._albums = []
+        self._positions = {}
+        self._thumbnails = FlowThumbnails()
+        self._thumbnail_size = 0
+        self._window_size = 0
+        self._window_start = 0
+        self._window_end = 0
 
     def get_identifier(self, album):
-        index = -1
-        for row in self.album_identifier:
-            if self.album_identifier[row] == album:
-                index = row
-                break
+        return self._identifiers.get(album)
 
-        if index == -1:
-            return None
+    def _get_position(self, album):
+        identifier = self._identifiers.get(album)
+
+        return self._positions.get(identifier)
+
+    def _add_identifier(self, album):
+        if album not in self._identifiers:
+            self._identifiers[album] = self._next_identifier
+            self.album_identifier[self._next_identifier] = album
+            self._next_identifier += 1
+
+        return self._identifiers[album]
+
+    def _remove_identifier(self, album):
+        identifier = self._identifiers.pop(album)
+        del self.album_identifier[identifier]
+
+    def _item(self, position):
+        album = self._albums[position]
+
+        # need a white vs black when we change the background colour
+        cover = album.cover.original.replace(
+            'rhythmbox-missing-artwork.svg',
+            'rhythmbox-missing-artwork.png')
+
+        thumbnail = None
+        if cover != album.cover.original:
+            # the missing artwork is small enough already
+            thumbnail = cover
         else:
-            return row
+            thumbnail = self._thumbnails.lookup(cover, self._thumbnail_size,
+                                                self._thumbnail_ready)
+
+        obj = {}
+        obj['filename'] = thumbnail or cover
+        obj['original'] = cover
+        obj['title'] = album.artist
+        obj['caption'] = album.name
+        obj['identifier'] = str(self._identifiers[album])
+
+        return obj
+
+    def _thumbnail_ready(self, original, thumbnail):
+        if thumbnail == original:
+            return
+
+        for position in range(self._window_start, self._window_end):
+            if self._albums[position].cover.original == original:
+                obj = self._item(position)
+                self.callback_view.view.execute_script(
+                    "update_album(%s)" % json.dumps(obj))
+
+    def _window_bounds(self, position):
+        total = len(self._albums)
+
+        start = max(0, position - self._window_size // 2)
+        end = min(total, start + self._window_size)
+        start = max(0, end - self._window_size)
+
+        return start, end
+
+    def _shift_window(self, identifier, webview):
+        '''
+        Recentres the window of covers held by the page once the active cover
+        gets close to either end of it.
+        '''
+        position = self._positions.get(identifier)
+
+        if position is None or \
+                not self._window_start <= position < self._window_end:
+            return
+
+        margin = self._window_size // 4
+
+        if position - self._window_start >= margin and \
+                        self._window_end - 1 - position >= margin:
+            return
+
+        start, end = self._window_bounds(position)
+
+        if (start, end) == (self._window_start, self._window_end):
+            return
+
+        obj = {}
+        obj['remove'] = [str(self._identifiers[self._albums[index]])
+                         for index in range(self._window_start, self._window_end)
+                         if index < start or index >= end]
+        obj['prepend'] = [self._item(index) for index in
+                          range(start, min(end, self._window_start))]
+        obj['append'] = [self._item(index) for index in
+                         range(max(start, self._window_end), end)]
+
+        self._window_start = start
+        self._window_end = end
+
+        webview.execute_script("update_flow_window(%s)" % json.dumps(obj))
 
     def update_album(self, model, album_path, album_iter, webview):
         album = model.get_from_path(album_path)
-        index = -1
-        for row in self.album_identifier:
-            if self.album_identifier[row] == album:
-                index = row
-                break
+        position = self._get_position(album)
 
-        if index == -1:
+        if position is None or \
+                not self._window_start <= position < self._window_end:
             return
 
-        obj = {}
-        obj['filename'] = album.cover.original
-        obj['title'] = album.artist
-        obj['caption'] = album.name
-        obj['identifier'] = str(index)
+        obj = self._item(position)
 
-        webview.execute_script("update_album('%s')" % json.dumps(obj))
+        webview.execute_script("update_album(%s)" % json.dumps(obj))
 
     def receive_message_signal(self, webview, param):
         # this will be key to passing stuff back and forth - need
@@ -383,54 +599,90 @@ class FlowControl(object):
         elif signal == 'dropactive':
             self.callback_view.item_drop_callback(self.album_identifier[int(args['param'][0])],
                                                   args['param'][1])
+        elif signal == 'activechanged':
+            self._shift_window(int(args['param'][0]), webview)
         else:
             print("unhandled signal: %s" % signal)
 
     def scroll_to_album(self, album, webview):
-        for row in self.album_identifier:
-            if self.album_identifier[row] == album:
-                webview.execute_script("scroll_to_identifier('%s')" % str(row))
-                break
+        '''
+        Scrolls the flow to the given album. Returns False if the album isn't
+        held by the page, in which case the flow needs to be reloaded.
+        '''
+        position = self._get_position(album)
 
-    def initialise(self, model, max_covers):
+        if position is None:
+            return True
 
+        if not self._window_start <= position < self._window_end:
+            return False
+
+        webview.execute_script("scroll_to_identifier('%s')" %
+                               str(self._identifiers[album]))
+
+        return True
+
+    def initialise(self, model, window_size, thumbnail_size, start_album):
+        '''
+        Recreates the list of albums shown by the flow, using thumbnails of
+        `thumbnail_size` for all but the active cover, and returns a tuple
+        with the html for the window of covers around `start_album`, the
+        position of `start_album` within that window and whether the whole
+        flow fits in the window (so it can be circular).
+        '''
         album_col = model.columns['album']
-        index = 0
-        items = ""
-        self.album_identifier = {}
 
-        def html_elements(fullfilename, title, caption, identifier):
+        def html_elements(fullfilename, original, title, caption,
+                          identifier):
 
             return '<div class="item"><img class="content" src="' + \
-                   escape(fullfilename) + '" title="' + \
+                   escape(fullfilename) + '" thumbnail="' + \
+                   escape(fullfilename) + '" original="' + \
+                   escape(original) + '" title="' + \
                    escape(title) + '" identifier="' + \
                    identifier + '"/> <div class="caption">' + \
                    escape(caption) + '</div> </div>'
 
+        self._albums = [row[album_col] for row in model.store]
+        self._positions = {}
 
-        for row in model.store:
+        for position, album in enumerate(self._albums):
+            self._positions[self._add_identifier(album)] = position
 
-            cover = row[album_col].cover.original
-            cover = cover.replace(
-                'rhythmbox-missing-artwork.svg',
-                'rhythmbox-missing-artwork.png')  # # need a white vs black when we change the background colour
+        # forget the albums that were removed from the model; the filtered
+        # out ones keep their identifiers
+        for album in list(self._identifiers):
+            if self._identifiers[album] not in self._positions and \
+                    not (model.contains(album.name, album.artist) and
+                         model.get(album.name, album.artist) is album):
+                self._remove_identifier(album)
 
-            self.album_identifier[index] = row[album_col]
-            items += html_elements(
-                fullfilename=cover,
-                caption=row[album_col].name,
-                title=row[album_col].artist,
-                identifier=str(index))
+        start_position = self._get_position(start_album)
 
-            index += 1
+        # thumbnails still waiting for the previous flow aren't needed anymore
+        self._thumbnails.cancel()
+        self._thumbnail_size = thumbnail_size
 
-            if index == max_covers:
-                break
+        self._window_size = window_size
+        self._window_start, self._window_end = self._window_bounds(
+            start_position or 0)
 
-        if index != 0:
-            # self.callback_view.last_album = self.album_identifier[0]
-            pass
-        else:
+        items = ""
+        for position in range(self._window_start, self._window_end):
+            obj = self._item(position)
+            items += html_elements(
+                fullfilename=obj['filename'],
+                original=obj['original'],
+                caption=obj['caption'],
+                title=obj['title'],
+                identifier=obj['identifier'])
+
+        if len(self._albums) == 0:
             self.callback_view.last_album = None
 
-        return items
+        if start_position is not None:
+            start_position -= self._window_start
+
+        circular = self._window_end - self._window_start == len(self._albums)
+
+        return items, start_position, circular
@@ -253,6 +253,16 @@ class EntryViewPane(object):
                                          selected[0].artist,
                                          selected[0].name)
 
+            try:
+                neighbours = self.source.album_manager.model.get_neighbours(
+                    selected[0])
+            except (KeyError, TypeError, ValueError):
+                # the album isn't on the view anymore
+                neighbours = []
+
+            self.source.artist_info.prefetch(
+                [album.artist for album in neighbours])
+
         self.entry_view.set_sorting_order('track-number', Gtk.SortType.ASCENDING)
 
         player = self.shell.props.shell_player
@@ -21,19 +21,204 @@ import shutil
 import os
 import sys
 import subprocess
+import collections
+import base64
+import hashlib
+import json
+import tempfile
+import zipfile
+import tarfile
 
 from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import GLib
 from gi.repository import RB
-from gi.repository import Gdk
 from gi.repository import Peas
 from gi.repository import Gst
+from gi.repository import GdkPixbuf
 
 from coverart_utils import NaturalString
+from coverart_utils import WorkerPool
+from coverart_utils import save_json_file
+from coverart_album import ext_db_key_fields
 import rb
 import coverart_rb3compat as rb3compat
 
+# mutagen is optional; without it the search providers plugin embeds the art
+try:
+    import mutagen
+    from mutagen.id3 import ID3, APIC
+    from mutagen.flac import FLAC, Picture
+    from mutagen.mp4 import MP4, MP4Cover
+    from mutagen.oggvorbis import OggVorbis
+except ImportError:
+    mutagen = None
+
+
+# name of the file, on the export folder, keeping track of what was exported
+MANIFEST_NAME = '.coverart_export.json'
+
+# tracks exported between each save of the manifest
+MANIFEST_SAVE_INTERVAL = 20
+
+# name of the archive holding all the tracks, when not using one per album
+ARCHIVE_NAME = 'coverart_export'
+
+
+class ExportManifest(object):
+    '''
+    Keeps track of the tracks exported to a folder, so exporting them again
+    only writes the ones whose source, conversion options or cover changed.
+
+    Each output file (relative to the export folder) is recorded along with
+    its source path, size and mtime, the conversion options and the hash of
+    the art embedded on it. The manifest is saved on the export folder every
+    few tracks, so an interrupted export carries on where it was left.
+
+    :param folder: `str` path of the export folder.
+    '''
+
+    def __init__(self, folder):
+        self._folder = folder
+        self._path = os.path.join(folder, MANIFEST_NAME)
+        self._unsaved = 0
+
+        try:
+            with open(self._path) as manifest_file:
+                self._entries = json.load(manifest_file)
+        except Exception:
+            self._entries = {}
+
+    def _key(self, dest):
+        return os.path.relpath(dest, self._folder)
+
+    def is_current(self, dest, source, stat, options, art_hash):
+        '''
+        Tells whether the output file was exported from the same source,
+        with the same options and cover, and is still there untouched.
+
+        :param dest: `str` path of the output file.
+        :param source: `str` path of the source track.
+        :param stat: `os.stat_result` of the source track or None if it
+            couldn't be read.
+        :param options: `dict` of conversion options.
+        :param art_hash: `str` hash of the art to embed or None.
+        '''
+        entry = self._entries.get(self._key(dest))
+
+        if not entry or not stat:
+            return False
+
+        try:
+            output_size = os.path.getsize(dest)
+        except OSError:
+            return False
+
+        if entry.get('output_size') is None:
+            # the output was modified after being recorded
+            output_size = None
+
+        return entry == self._entry(source, stat, options, art_hash,
+                                    output_size)
+
+    def record(self, dest, source, stat, options, art_hash,
+               check_output=True):
+        '''
+        Records an output file once it's completely exported, saving the
+        manifest every `MANIFEST_SAVE_INTERVAL` tracks.
+
+        :param check_output: `bool` whether the output's current size can be
+            used to check it later on. It can't when the output is still
+            going to be modified.
+        '''
+        try:
+            output_size = os.path.getsize(dest)
+        except OSError:
+            return
+
+        if not check_output:
+            output_size = None
+
+        self._entries[self._key(dest)] = self._entry(source, stat, options,
+                                                     art_hash, output_size)
+
+        self._unsaved += 1
+        if self._unsaved >= MANIFEST_SAVE_INTERVAL:
+            self.save()
+
+    def forget(self, dest):
+        '''
+        Removes an output file from the manifest, before overwriting it.
+        '''
+        if self._entries.pop(self._key(dest), None):
+            self._unsaved += 1
+
+    def save(self):
+        if not self._unsaved:
+            return
+
+        self._unsaved = 0
+
+        try:
+            save_json_file(self._path, self._entries)
+        except Exception as e:
+            print("Couldn't save the export manifest: %s" % e)
+
+    def _entry(self, source, stat, options, art_hash, output_size):
+        return {'source': source,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'options': options,
+                'art': art_hash,
+                'output_size': output_size}
+
+
+class ExportArchive(object):
+    '''
+    Zip or tar archive the exported tracks are written into. Each track is
+    copied into it in small chunks, so the memory used doesn't depend on the
+    tracks' size. The archive is written under a temporary name and only
+    renamed once it's complete.
+
+    :param path: `str` path of the archive.
+    :param archive_format: `str` either 'zip' or 'tar'.
+    '''
+
+    def __init__(self, path, archive_format):
+        self.path = path
+        self._temp = path + '.part'
+
+        if archive_format == 'zip':
+            # audio is already compressed, don't waste time on it
+            self._archive = zipfile.ZipFile(self._temp, 'w',
+                                            zipfile.ZIP_STORED,
+                                            allowZip64=True)
+        else:
+            self._archive = tarfile.open(self._temp, 'w')
+
+    def add(self, filename, arcname):
+        '''
+        Writes a file into the archive. Meant to be run on a worker thread,
+        one file at a time.
+        '''
+        if isinstance(self._archive, zipfile.ZipFile):
+            self._archive.write(filename, arcname)
+        else:
+            self._archive.add(filename, arcname)
+
+    def close(self):
+        self._archive.close()
+        os.rename(self._temp, self.path)
+
+    def discard(self):
+        try:
+            self._archive.close()
+        except Exception:
+            pass
+
+        if os.path.exists(self._temp):
+            os.remove(self._temp)
+
 
 class CoverArtExport(GObject.Object):
     '''
@@ -49,6 +234,10 @@ class CoverArtExport(GObject.Object):
 
         self._gstreamer_has_initialised = False
 
+        # tracks copied or converted at the same time
+        self.max_jobs = os.cpu_count() or 1
+        self.running = False
+
     def is_search_plugin_enabled(self):
         peas = Peas.Engine.get_default()
         loaded_plugins = peas.get_loaded_plugins()
@@ -72,6 +261,12 @@ class CoverArtExport(GObject.Object):
 
         self._initialise_gstreamer()
 
+        self._can_embed = mutagen is not None
+
+        if not self._can_embed:
+            print("python3-mutagen isn't installed, the covers will be "
+                  "embedded by the search providers plugin")
+
         from coverart_search_tracks import CoverArtTracks
 
         search_tracks = CoverArtTracks()
@@ -91,6 +286,10 @@ class CoverArtExport(GObject.Object):
         bitrate_spinbutton = ui.get_object('bitrate_spinbutton')
         resize_checkbutton = ui.get_object('resize_checkbutton')
         resize_spinbutton = ui.get_object('resize_spinbutton')
+        archive_checkbutton = ui.get_object('archive_checkbutton')
+        archive_format_combobox = ui.get_object('archive_format_combobox')
+        archive_per_album_checkbutton = ui.get_object(
+            'archive_per_album_checkbutton')
         bitrate_spinbutton.set_value(self.TARGET_BITRATE)
         resize_spinbutton.set_value(128)
 
@@ -114,108 +313,446 @@ class CoverArtExport(GObject.Object):
             resize = int(resize_spinbutton.get_value())
         else:
             resize = -1
+        if archive_checkbutton.get_active():
+            archive_format = archive_format_combobox.get_active_id()
+        else:
+            archive_format = None
+        archive_per_album = archive_per_album_checkbutton.get_active()
 
         embeddialog.destroy()
 
-        albums = {}
-        total = 0
+        self._options = {'folder': final_folder_store,
+                         'use_album_name': use_album_name,
+                         'open_filemanager': open_filemanager,
+                         'convert': convert,
+                         'bitrate': bitrate,
+                         'resize': resize,
+                         'archive': archive_format,
+                         'archive_per_album': archive_per_album}
+        self._search_tracks = search_tracks
+
+        self._staging = None
+
+        if archive_format:
+            self._manifest = None
+
+            if convert or self._can_embed:
+                try:
+                    # tracks that are converted or get their art embedded
+                    # are written here before going into the archives
+                    self._staging = tempfile.mkdtemp(
+                        prefix='.coverart_export_', dir=final_folder_store)
+                except OSError as err:
+                    print(err.args[0])
+                    return
+        else:
+            self._manifest = ExportManifest(final_folder_store)
+
+        self._jobs = collections.deque()
+        self._archives = {}
+        self._archive_tracks = collections.Counter()
 
         for album in selected_albums:
-            albums[album] = album.get_tracks()
-            total = total + len(albums[album])
-
-        self._track_count = 1
-
-        def complete():
-            self.album_manager.progress = 1
-
-            if open_filemanager:
-                #code taken from http://stackoverflow.com/questions/1795111/is-there-a-cross-platform-way-to-open-a-file-browser-in-python
-                if sys.platform == 'win32':
-                    import winreg
-
-                    path = r('SOFTWARE\Microsoft\Windows NT\CurrentVersion\Winlogon')
-                    for root in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
-                        try:
-                            with winreg.OpenKey(root, path) as k:
-                                value, regtype = winreg.QueryValueEx(k, 'Shell')
-                        except WindowsError:
-                            pass
-                        else:
-                            if regtype in (winreg.REG_SZ, winreg.REG_EXPAND_SZ):
-                                shell = value
-                            break
-                    else:
-                        shell = 'Explorer.exe'
-                    subprocess.Popen([shell, final_folder_store])
+            for track in album.get_tracks():
+                self._jobs.append((album, track))
+
+                if archive_format:
+                    self._archive_tracks[self._archive_path(album)] += 1
+
+        self._total = len(self._jobs)
+        self._done = 0
+        self._skipped = 0
+        self._staged = 0
+        self._running = 0
+        self._converters = set()
+        self._art_payloads = {}
+        self._copy_pool = WorkerPool(self.max_jobs)
+        # archives are written by a single thread, one track after another
+        self._archive_pool = WorkerPool(1)
+        self._start_id = None
+        self.running = True
+
+        self._start_jobs()
+
+    def cancel(self):
+        '''
+        Stops the export. Tracks being converted are discarded, tracks being
+        copied finish but nothing else is done with them. Unfinished archives
+        are removed.
+        '''
+        if not self.running:
+            return
 
-                elif sys.platform == 'darwin':
-                    subprocess.Popen(['open', final_folder_store])
+        self._jobs.clear()
+        self._copy_pool.cancel()
+        self._archive_pool.cancel()
 
-                else:
-                    subprocess.Popen(['xdg-open', final_folder_store])
+        if self._start_id is not None:
+            GLib.source_remove(self._start_id)
+            self._start_id = None
+
+        for converter in list(self._converters):
+            output = converter.get_by_name('sink').get_property('location')
+            self._stop_converter(converter)
+
+            # don't leave a half converted track that looks like a good one
+            try:
+                os.remove(output)
+            except OSError:
+                pass
+
+        if self._options['archive']:
+            # after the track being archived, if any
+            self._archive_pool.add_job(discard_archives, None,
+                                       list(self._archives.values()),
+                                       self._staging, self._copy_pool)
+            self._archives = {}
+            self._staging = None
+
+        self._running = 0
+        self._export_finished(cancelled=True)
+
+    def _start_jobs(self):
+        '''
+        Starts exporting tracks until the maximum number of concurrent jobs
+        is reached.
+        '''
+        while self._jobs and self._running < self.max_jobs:
+            album, track = self._jobs.popleft()
+            job = self._create_job(album, track)
 
-        self._albumiter = iter(albums)
-        self._tracknumber = 0
-        self._album = next(self._albumiter)
+            if self._manifest and \
+                    self._manifest.is_current(job['dest'], job['source'],
+                                              job['stat'], job['options'],
+                                              job['art_hash']):
+                self._done += 1
+                self._skipped += 1
+                continue
 
-        def idle_call(data):
-            exit_idle = True
+            self._running += 1
+            self._export_track(job)
 
-            track = albums[self._album][self._tracknumber]
+        self.album_manager.progress = float(self._done) / (self._total + 1)
 
-            if not process_track(self._album, track):
-                exit_idle = False
+        if not self._running:
+            self._export_finished()
 
-            self._tracknumber = self._tracknumber + 1
+    def _create_job(self, album, track):
+        '''
+        Returns a `dict` with everything needed to export a track and to
+        record it on the manifest afterwards.
+        '''
+        source = rb3compat.unquote(track.location)[7:]
 
-            if self._tracknumber >= len(albums[self._album]):
-                try:
-                    self._tracknumber = 0
-                    self._album = next(self._albumiter)
-                except StopIteration:
-                    exit_idle = False
+        if self._options['use_album_name']:
+            album_folder = RB.search_fold(album.name)
+            folder_store = self._options['folder'] + '/' + album_folder
+        else:
+            album_folder = ''
+            folder_store = self._options['folder']
+
+        payload, art_hash = self._get_art_payload(album)
+        archive = self._archive_path(album)
+
+        # tracks going into an archive are only written somewhere else first
+        # when they have to be changed
+        staged = bool(archive) and (self._options['convert'] or
+                                    bool(payload and self._can_embed))
+
+        if staged:
+            # each track gets its own folder so names can't clash
+            self._staged += 1
+            folder_store = os.path.join(self._staging, str(self._staged))
+
+        if archive and not staged:
+            # added to the archive straight from the source
+            dest = source
+            options = {'convert': False}
+        elif self._options['convert']:
+            dest = self._calc_mp3_filename(source, folder_store)
+            options = {'convert': True, 'bitrate': self._options['bitrate']}
+        else:
+            dest = os.path.join(folder_store, os.path.basename(source))
+            options = {'convert': False}
 
-            if not exit_idle:
-                complete()
+        try:
+            stat = os.stat(source)
+        except OSError:
+            stat = None
+
+        return {'album': album,
+                'source': source,
+                'folder': folder_store,
+                'dest': dest,
+                'archive': archive,
+                'staged': staged,
+                'arcname': os.path.join(album_folder, os.path.basename(dest)),
+                'stat': stat,
+                'options': options,
+                'payload': payload,
+                'art_hash': art_hash}
+
+    def _export_track(self, job):
+        if job['archive'] and not job['staged']:
+            # nothing to change on the track
+            self._archive_track(job)
+            return
+
+        if self._manifest:
+            # the output is about to be overwritten
+            self._manifest.forget(job['dest'])
 
-            return exit_idle
+        if self._options['convert']:
+            try:
+                if not os.path.exists(job['folder']):
+                    os.makedirs(job['folder'])
+            except OSError as err:
+                print(err.args[0])
+                self._track_exported(job, False)
+                return
 
-        def process_track(album, track):
-            self.album_manager.progress = self._track_count / total
-            self._track_count = self._track_count + 1
+            self.convert_to_mp3(job['source'], job['folder'],
+                                self._options['bitrate'],
+                                lambda success: self._track_exported(
+                                    job, success))
+        else:
+            self._copy_pool.add_job(copy_track,
+                                    lambda result, error: self._track_exported(
+                                        job, not error),
+                                    job['source'], job['folder'])
+
+    def _track_exported(self, job, success):
+        '''
+        Called on the main loop once a track is copied or converted.
+        '''
+        if not self.running:
+            return
+
+        if not success:
+            print("Couldn't export %s" % job['dest'])
+            self._track_done(job)
+            return
+
+        if job['payload']:
+            # write the already prepared art off the main thread
+            self._copy_pool.add_job(embed_art,
+                                    lambda embedded, error: self._art_embedded(
+                                        job, embedded, error),
+                                    job['dest'], job['payload'])
+        else:
+            self._art_embedded(job, False, None)
+
+    def _art_embedded(self, job, embedded, error):
+        if not self.running:
+            return
+
+        if error:
+            # leave it out of the manifest so it's exported again next time
+            print("Couldn't embed the cover on %s: %s" % (job['dest'], error))
+        elif self._manifest and job['stat']:
+            # the search providers plugin rewrites the track when embedding
+            # the art, so its size can't be known here
+            self._manifest.record(job['dest'], job['source'], job['stat'],
+                                  job['options'], job['art_hash'],
+                                  check_output=embedded)
+
+        if job['archive']:
+            # the search providers plugin can't embed the art on tracks that
+            # go into an archive, they're archived as they are
+            self._archive_track(job)
+            return
 
-            key = album.create_ext_db_key()
-            finalPath = rb3compat.unquote(track.location)[7:]
-            album_name = RB.search_fold(album.name)
+        if not embedded:
+            # let the search providers plugin deal with it
+            desturi = 'file://' + rb3compat.pathname2url(job['dest'])
+            key = job['album'].create_ext_db_key()
 
-            if use_album_name:
-                folder_store = final_folder_store + '/' + album_name
+            self._search_tracks.embed(desturi, key, self._options['resize'])
+
+        self._track_done(job)
+
+    def _archive_path(self, album):
+        '''
+        Returns the path of the archive an album's tracks go into, or None
+        when not exporting to archives.
+        '''
+        archive_format = self._options['archive']
+
+        if not archive_format:
+            return None
+
+        if self._options['archive_per_album']:
+            # albums with the same name by different artists mustn't clash
+            name = RB.search_fold(album.artist + ' - ' + album.name)
+            name = name.replace(os.sep, '_')
+        else:
+            name = ARCHIVE_NAME
+
+        return os.path.join(self._options['folder'],
+                            name + '.' + archive_format)
+
+    def _archive_track(self, job):
+        path = job['archive']
+
+        try:
+            if path not in self._archives:
+                self._archives[path] = ExportArchive(path,
+                                                     self._options['archive'])
+        except Exception as e:
+            print("Couldn't create %s: %s" % (path, e))
+            self._track_done(job)
+            return
+
+        self._archive_pool.add_job(archive_track,
+                                   lambda result, error: self._track_archived(
+                                       job, error),
+                                   self._archives[path], job['dest'],
+                                   job['arcname'], job['staged'])
+
+    def _track_archived(self, job, error):
+        if not self.running:
+            return
+
+        if error:
+            print("Couldn't archive %s: %s" % (job['dest'], error))
+
+        self._track_done(job)
+
+    def _track_done(self, job):
+        self._running -= 1
+        self._done += 1
+
+        if job['archive']:
+            self._archive_tracks[job['archive']] -= 1
+
+            if not self._archive_tracks[job['archive']]:
+                # all the tracks going into this archive are done with
+                self._close_archive(job['archive'])
+
+        # tracks can fail while the jobs are being started, so the next ones
+        # are started from the main loop instead of recursing
+        if self._start_id is None:
+            self._start_id = GLib.idle_add(self._on_start_jobs)
+
+    def _on_start_jobs(self, *args):
+        self._start_id = None
+
+        if self.running:
+            self._start_jobs()
+
+        return False
+
+    def _close_archive(self, path):
+        archive = self._archives.pop(path, None)
+
+        if not archive:
+            return
+
+        try:
+            archive.close()
+        except Exception as e:
+            print("Couldn't write %s: %s" % (path, e))
+            archive.discard()
+
+    def _get_art_payload(self, album):
+        '''
+        Returns the image data and mime type to embed on an album's tracks,
+        preparing it (resized if needed) the first time it's asked for, and
+        the hash of the image data. The payloads are kept by ext-db key and
+        size for the whole export.
+        '''
+        key = album.create_ext_db_key()
+        resize = self._options['resize']
+        cache_key = (repr(ext_db_key_fields(key)), resize)
+
+        if cache_key not in self._art_payloads:
+            payload = self._prepare_art_payload(key, resize)
+
+            if payload:
+                art_hash = hashlib.sha1(payload[0]).hexdigest()
             else:
-                folder_store = final_folder_store
+                art_hash = None
 
-            try:
-                if not os.path.exists(folder_store):
-                    os.makedirs(folder_store)
+            self._art_payloads[cache_key] = (payload, art_hash)
 
-                if convert:
-                    self.convert_to_mp3(finalPath, folder_store, bitrate)
-                    finalPath = self._calc_mp3_filename(finalPath, folder_store)
-                    print(finalPath)
-                else:
-                    shutil.copy(finalPath, folder_store)
-            except IOError as err:
-                print(err.args[0])
-                return False
+        return self._art_payloads[cache_key]
+
+    def _prepare_art_payload(self, key, resize):
+        art_location = self.album_manager.cover_man.cover_db.lookup(key)
 
-            dest = os.path.join(folder_store, os.path.basename(finalPath))
-            desturi = 'file://' + rb3compat.pathname2url(dest)
+        if art_location and not isinstance(art_location, str):
+            # RB 3.2 returns a tuple (path, key)
+            art_location = art_location[0]
 
-            return search_tracks.embed(desturi, key, resize)
+        if not art_location or not os.path.exists(art_location):
+            return None
 
-        data = None
+        try:
+            if resize > 0:
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(art_location,
+                                                                resize, resize)
+                success, data = pixbuf.save_to_bufferv('jpeg', ['quality'],
+                                                       ['90'])
+
+                return bytes(data), 'image/jpeg'
+
+            info = GdkPixbuf.Pixbuf.get_file_info(art_location)[0]
+
+            with open(art_location, 'rb') as art_file:
+                return art_file.read(), info.get_mime_types()[0]
+        except Exception as e:
+            print("Couldn't prepare the cover to embed: %s" % e)
+            return None
+
+    def _export_finished(self, cancelled=False):
+        if not self.running:
+            return
+
+        self.running = False
+        self.album_manager.progress = 1
+
+        if self._manifest:
+            self._manifest.save()
+
+        for path in list(self._archives.keys()):
+            self._close_archive(path)
+
+        if self._staging:
+            shutil.rmtree(self._staging, ignore_errors=True)
+
+        if cancelled:
+            return
 
-        Gdk.threads_add_idle(GLib.PRIORITY_DEFAULT_IDLE, idle_call, data)
+        if self._skipped:
+            print('%d tracks were already exported' % self._skipped)
+
+        if self._options['open_filemanager']:
+            final_folder_store = self._options['folder']
+
+            #code taken from http://stackoverflow.com/questions/1795111/is-there-a-cross-platform-way-to-open-a-file-browser-in-python
+            if sys.platform == 'win32':
+                import winreg
+
+                path = r('SOFTWARE\Microsoft\Windows NT\CurrentVersion\Winlogon')
+                for root in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
+                    try:
+                        with winreg.OpenKey(root, path) as k:
+                            value, regtype = winreg.QueryValueEx(k, 'Shell')
+                    except WindowsError:
+                        pass
+                    else:
+                        if regtype in (winreg.REG_SZ, winreg.REG_EXPAND_SZ):
+                            shell = value
+                        break
+                else:
+                    shell = 'Explorer.exe'
+                subprocess.Popen([shell, final_folder_store])
+
+            elif sys.platform == 'darwin':
+                subprocess.Popen(['open', final_folder_store])
+
+            else:
+                subprocess.Popen(['xdg-open', final_folder_store])
 
     def _initialise_gstreamer(self):
 
@@ -225,6 +762,8 @@ class CoverArtExport(GObject.Object):
         self._gstreamer_has_initialised = True
         Gst.init(None)
 
+    def _create_converter(self):
+
         def on_new_decoded_pad(dbin, pad):
             decode = pad.get_parent()
             pipeline = decode.get_parent()
@@ -238,7 +777,7 @@ class CoverArtExport(GObject.Object):
 
         converter = Gst.Pipeline.new('converter')
 
-        source = Gst.ElementFactory.make('filesrc', None)
+        source = Gst.ElementFactory.make('filesrc', 'source')
 
         decoder = Gst.ElementFactory.make('decodebin', 'decoder')
         convert = Gst.ElementFactory.make('audioconvert', 'convert')
@@ -276,55 +815,152 @@ class CoverArtExport(GObject.Object):
         Gst.Element.link(xing, mux)
         Gst.Element.link(mux, sink)
 
-        self.converter = converter
-        self.source = source
-        self.sink = sink
-        self.encoder = encoder
+        return converter
 
     def _calc_mp3_filename(self, filename, save_folder):
         finalname = os.path.basename(filename)
         finalname = finalname.rsplit('.')[0] + ".mp3"
         return save_folder + "/" + finalname
 
-    def convert_to_mp3(self, filename, save_folder, bitrate):
+    def convert_to_mp3(self, filename, save_folder, bitrate, callback):
+        '''
+        Converts a track to mp3 without blocking, calling `callback` with a
+        `bool` telling whether the conversion succeeded once it finishes.
+        '''
+        converter = self._create_converter()
 
-        self.source.set_property('location', filename)
-        self.sink.set_property('location', self._calc_mp3_filename(filename, save_folder))
+        converter.get_by_name('source').set_property('location', filename)
+        converter.get_by_name('sink').set_property(
+            'location', self._calc_mp3_filename(filename, save_folder))
         print(bitrate)
         if bitrate < 32:
             bitrate = self.TARGET_BITRATE
 
-        self.encoder.set_property('bitrate', int(bitrate))
-        print(bitrate)
+        converter.get_by_name('encoder').set_property('bitrate', int(bitrate))
+
+        # watch the bus instead of waiting for the conversion to finish
+        bus = converter.get_bus()
+        bus.add_signal_watch()
+        converter.watch_id = bus.connect('message', self._on_converter_message,
+                                         converter, callback)
+
+        self._converters.add(converter)
 
         # Start playing
-        ret = self.converter.set_state(Gst.State.PLAYING)
+        ret = converter.set_state(Gst.State.PLAYING)
 
         if ret == Gst.StateChangeReturn.FAILURE:
             print("Unable to set the pipeline to the playing state.", sys.stderr)
-            exit(-1)
-
-        # Wait until error or EOS
-        bus = self.converter.get_bus()
-        try:
-            msg = bus.timed_pop_filtered(
-                Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR | Gst.MessageType.EOS)
-        except:
-            # for some reason in ubuntu 12.04 Gst.CLOCK_TIME_NONE fails
-            msg = bus.timed_pop_filtered(
-                18446744073709551615, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+            self._stop_converter(converter)
+            callback(False)
 
+    def _on_converter_message(self, bus, msg, converter, callback):
         # Parse message
-        if (msg):
-            if msg.type == Gst.MessageType.ERROR:
-                err, debug = msg.parse_error()
-                print("Error received from element %s: %s" % (
-                    msg.src.get_name(), err), sys.stderr)
-                print("Debugging information: %s" % debug, sys.stderr)
-            elif msg.type == Gst.MessageType.EOS:
-                print("End-Of-Stream reached.")
-            else:
-                print("Unexpected message received.", sys.stderr)
+        if msg.type == Gst.MessageType.ERROR:
+            err, debug = msg.parse_error()
+            print("Error received from element %s: %s" % (
+                msg.src.get_name(), err), sys.stderr)
+            print("Debugging information: %s" % debug, sys.stderr)
+        elif msg.type == Gst.MessageType.EOS:
+            print("End-Of-Stream reached.")
+        else:
+            return
 
+        self._stop_converter(converter)
+        callback(msg.type == Gst.MessageType.EOS)
+
+    def _stop_converter(self, converter):
         # Free resources
-        self.converter.set_state(Gst.State.NULL)
+        bus = converter.get_bus()
+        bus.disconnect(converter.watch_id)
+        bus.remove_signal_watch()
+
+        converter.set_state(Gst.State.NULL)
+        self._converters.discard(converter)
+
+
+def embed_art(filename, payload):
+    '''
+    Embeds an image as the front cover of a track. Returns False when the
+    track's format isn't supported so the search providers plugin embeds it
+    instead, preparing the cover again for each track. Needs mutagen, a
+    dependency listed on the README. Meant to be run on a worker thread.
+
+    :param filename: `str` path of the track.
+    :param payload: `tuple` with the image data and its mime type.
+    '''
+    data, mime = payload
+    audio = mutagen.File(filename)
+
+    if audio is None:
+        return False
+
+    if isinstance(audio, FLAC) or isinstance(audio, OggVorbis):
+        picture = Picture()
+        picture.type = 3  # front cover
+        picture.mime = mime
+        picture.data = data
+
+        if isinstance(audio, FLAC):
+            audio.clear_pictures()
+            audio.add_picture(picture)
+        else:
+            audio['metadata_block_picture'] = [
+                base64.b64encode(picture.write()).decode('ascii')]
+    elif isinstance(audio, MP4):
+        if mime == 'image/png':
+            image_format = MP4Cover.FORMAT_PNG
+        else:
+            image_format = MP4Cover.FORMAT_JPEG
+
+        audio['covr'] = [MP4Cover(data, imageformat=image_format)]
+    elif isinstance(audio.tags, ID3) or audio.tags is None:
+        if audio.tags is None:
+            audio.add_tags()
+
+        audio.tags.delall('APIC')
+        audio.tags.add(APIC(encoding=3, mime=mime, type=3, desc='Cover',
+                            data=data))
+    else:
+        return False
+
+    audio.save()
+
+    return True
+
+
+def archive_track(archive, filename, arcname, remove):
+    '''
+    Writes a track into an archive, removing it afterwards if it was only
+    written to go into the archive. Meant to be run on a worker thread.
+    '''
+    try:
+        archive.add(filename, arcname)
+    finally:
+        if remove:
+            os.remove(filename)
+
+
+def discard_archives(archives, staging, copy_pool):
+    '''
+    Removes unfinished archives and the tracks waiting to go into them,
+    once the tracks still being written to the staging folder are done.
+    Meant to be run on a worker thread.
+    '''
+    for archive in archives:
+        archive.discard()
+
+    if staging:
+        copy_pool.join()
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def copy_track(filename, save_folder):
+    '''
+    Copies a track into a folder, creating it if needed. Meant to be run on a
+    worker thread.
+    '''
+    if not os.path.exists(save_folder):
+        os.makedirs(save_folder, exist_ok=True)
+
+    shutil.copy(filename, save_folder)
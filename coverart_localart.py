@@ -0,0 +1,432 @@
+# -*- Mode: python; coding: utf-8; tab-width: 4; indent-tabs-mode: nil; -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
+
+import os
+import json
+import threading
+import time
+
+from gi.repository import GLib
+from gi.repository import Gdk
+from gi.repository import GdkPixbuf
+from gi.repository import Gst
+from gi.repository import GstPbutils
+from gi.repository import RB
+
+from coverart_utils import WorkerPool
+from coverart_utils import save_json_file
+
+# names of the image files usually containing an album's front cover, from
+# the most to the least reliable
+FOLDER_ART_NAMES = ('cover', 'folder', 'front', 'albumart', 'album', 'art')
+
+# words indicating an image isn't the front cover
+FOLDER_ART_EXCLUDED = ('back', 'inlay', 'inside', 'tray', 'cd', 'disc',
+                       'small')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+
+# images smaller than this (in bytes) are most likely broken or thumbnails
+MIN_IMAGE_SIZE = 1024
+
+# directories scanned by each job on the worker pool
+SCAN_BATCH = 16
+
+# seconds the embedded art extraction waits between tracks, depending on
+# whether something is playing or not
+EMBEDDED_ART_DELAY = 0.05
+EMBEDDED_ART_PLAYING_DELAY = 0.5
+
+# seconds given to GStreamer to read a track's tags
+EMBEDDED_ART_TIMEOUT = 5
+
+# value of the image-type field of a tag image that is a front cover
+FRONT_COVER_IMAGE_TYPE = 1
+
+
+def album_directories(album):
+    '''
+    Returns the local directories containing an album's tracks.
+
+    :param album: `Album` whose tracks' directories we want.
+    '''
+    directories = set()
+
+    for track in album.get_tracks():
+        location = track.location
+
+        if not location or not location.startswith('file://'):
+            continue
+
+        try:
+            filename = GLib.filename_from_uri(location)[0]
+        except GLib.GError:
+            continue
+
+        directories.add(os.path.dirname(filename))
+
+    return directories
+
+
+def _rank_folder_image(name):
+    '''
+    Returns the rank of an image file by its name (lower is better) or None
+    if it doesn't look like a front cover.
+    '''
+    stem = os.path.splitext(name)[0].lower()
+
+    if stem in FOLDER_ART_NAMES:
+        return FOLDER_ART_NAMES.index(stem)
+
+    if any(word in stem for word in FOLDER_ART_EXCLUDED):
+        return None
+
+    for rank, art_name in enumerate(FOLDER_ART_NAMES):
+        if art_name in stem:
+            return len(FOLDER_ART_NAMES) + rank
+
+    # any other image could still be the cover, but it's the worst choice
+    return 2 * len(FOLDER_ART_NAMES)
+
+
+def find_folder_image(directory):
+    '''
+    Looks for the image most likely to be the front cover on a directory,
+    ranking the candidates by their names first and by their size then.
+    Returns the path of the image found or None.
+
+    :param directory: `str` path of the directory to look into.
+    '''
+    candidates = []
+    images = 0
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+
+            try:
+                if not entry.is_file():
+                    continue
+
+                size = entry.stat().st_size
+            except OSError:
+                continue
+
+            images += 1
+            rank = _rank_folder_image(entry.name)
+
+            if rank is not None and size >= MIN_IMAGE_SIZE:
+                candidates.append((rank, -size, entry.path))
+
+    if not candidates:
+        return None
+
+    rank, size, path = min(candidates)
+
+    if rank == 2 * len(FOLDER_ART_NAMES) and images > 1:
+        # with no hint on the names, only trust an image if it's alone
+        return None
+
+    return path
+
+
+class FolderArtScanner(object):
+    '''
+    Looks for cover images next to the albums' tracks, storing the ones found
+    on the album-art `RB.ExtDB`.
+
+    The directories are scanned in batches on a worker pool and the result of
+    each one is cached (and saved on the plugin's cache dir) along with the
+    directory's mtime, so it's only scanned again when its content changes.
+
+    :param cover_man: `AlbumCoverManager` used to store the covers found.
+    :param workers: `int` number of threads used to scan the directories.
+    '''
+
+    def __init__(self, cover_man, workers=4):
+        self._cover_man = cover_man
+        self._pool = WorkerPool(workers)
+        self._lock = threading.Lock()
+        self._save_id = None
+        self._path = RB.user_cache_dir() + '/coverart_browser/folder_art.json'
+
+        try:
+            with open(self._path) as cache_file:
+                self._cache = json.load(cache_file)
+        except Exception:
+            self._cache = {}
+
+    def scan(self, albums, finished=lambda *_: None):
+        '''
+        Looks for the covers of the given albums. The covers are stored as
+        soon as each batch of directories is scanned.
+
+        :param albums: `list` of `Album` to look covers for.
+        :param finished: `callable` called once all the directories are
+            scanned, with the list of albums for which no cover was found.
+        '''
+        directories = {}
+
+        for album in albums:
+            for directory in album_directories(album):
+                directories.setdefault(directory, []).append(album)
+
+        names = list(directories.keys())
+        stored = set()
+        batches = {'pending': 0}
+
+        def scanned(result, error):
+            self._directories_scanned(result, error, directories, stored)
+
+            batches['pending'] -= 1
+            if not batches['pending']:
+                finished([album for album in albums if album not in stored])
+
+        for start in range(0, len(names), SCAN_BATCH):
+            batches['pending'] += 1
+            self._pool.add_job(self._scan_directories, scanned,
+                               names[start:start + SCAN_BATCH])
+
+        if not batches['pending']:
+            finished(albums)
+
+    def cancel(self):
+        ''' Stops the scans that haven't finished yet. '''
+        self._pool.cancel()
+
+    def _scan_directories(self, directories):
+        # run on a worker thread
+        found = {}
+
+        for directory in directories:
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                continue
+
+            with self._lock:
+                cached = self._cache.get(directory)
+
+            if cached and cached[0] == mtime:
+                image = cached[1]
+            else:
+                try:
+                    image = find_folder_image(directory)
+                except OSError:
+                    image = None
+
+                with self._lock:
+                    self._cache[directory] = [mtime, image]
+
+            if image:
+                found[directory] = image
+
+        return found
+
+    def _directories_scanned(self, found, error, directories, stored):
+        if error:
+            print('Error while looking for folder art: ' + str(error))
+            found = {}
+
+        for directory, image in found.items():
+            for album in directories[directory]:
+                if album in stored or \
+                        album.cover is not self._cover_man.unknown_cover:
+                    continue
+
+                stored.add(album)
+                self._cover_man.store_cover_uri(
+                    album, GLib.filename_to_uri(image, None),
+                    RB.ExtDBSourceType.SEARCH)
+
+        if self._save_id is None:
+            self._save_id = Gdk.threads_add_timeout_seconds(
+                GLib.PRIORITY_DEFAULT_IDLE, 5, self._save, None)
+
+    def _save(self, *args):
+        self._save_id = None
+
+        with self._lock:
+            cache = dict(self._cache)
+
+        try:
+            save_json_file(self._path, cache)
+        except Exception as e:
+            print('Error while saving the folder art cache: ' + str(e))
+
+        return False
+
+
+def extract_embedded_image(uri):
+    '''
+    Reads the image embedded on a track's tags, preferring the front cover.
+    Returns a `GdkPixbuf.Pixbuf` or None if the track has no image.
+
+    :param uri: `str` uri of the track.
+    '''
+    discoverer = GstPbutils.Discoverer.new(EMBEDDED_ART_TIMEOUT * Gst.SECOND)
+    tags = discoverer.discover_uri(uri).get_tags()
+
+    if not tags:
+        return None
+
+    image = None
+    for tag in ('image', 'preview-image'):
+        for index in range(tags.get_tag_size(tag)):
+            found, sample = tags.get_sample_index(tag, index)
+
+            if not found:
+                continue
+
+            info = sample.get_info()
+            if info and info.has_field('image-type') and \
+                    int(info.get_value('image-type')) == FRONT_COVER_IMAGE_TYPE:
+                image = sample
+                break
+
+            image = image or sample
+
+        if image:
+            break
+
+    if not image:
+        return None
+
+    buffer = image.get_buffer()
+
+    loader = GdkPixbuf.PixbufLoader()
+    loader.write(buffer.extract_dup(0, buffer.get_size()))
+    loader.close()
+
+    return loader.get_pixbuf()
+
+
+class EmbeddedArtExtractor(object):
+    '''
+    Reads the covers embedded on the albums' tracks, storing the ones found
+    on the album-art `RB.ExtDB`.
+
+    Only one track is read for each album. Tracks are read one at a time on a
+    worker thread, pausing between them (for longer while something is
+    playing) to go easy on the disk.
+
+    The tracks found without an image are cached (and saved on the plugin's
+    cache dir) along with their mtime, so they're only read again when they
+    change.
+
+    :param cover_man: `AlbumCoverManager` used to store the covers found.
+    :param shell_player: `RB.ShellPlayer` used to know when music is playing.
+    '''
+
+    def __init__(self, cover_man, shell_player):
+        Gst.init(None)
+
+        self._cover_man = cover_man
+        self._pool = WorkerPool(1)
+        self._playing = shell_player.get_playing()[1]
+        self._lock = threading.Lock()
+        self._save_id = None
+        self._path = RB.user_cache_dir() + \
+            '/coverart_browser/embedded_art.json'
+
+        try:
+            with open(self._path) as cache_file:
+                self._no_image = json.load(cache_file)
+        except Exception:
+            self._no_image = {}
+
+        shell_player.connect('playing-changed', self._on_playing_changed)
+
+    def _on_playing_changed(self, player, playing):
+        self._playing = playing
+
+    def extract(self, albums):
+        '''
+        Looks for the covers embedded on the given albums' tracks.
+
+        :param albums: `list` of `Album` to look covers for.
+        '''
+        uris = set()
+
+        for album in albums:
+            uri = self._album_track_uri(album)
+
+            if uri and uri not in uris:
+                uris.add(uri)
+                self._pool.add_job(
+                    self._extract, lambda result, error, album=album:
+                    self._extracted(album, result, error), uri)
+
+    def cancel(self):
+        ''' Stops the extractions that haven't finished yet. '''
+        self._pool.cancel()
+
+    def _album_track_uri(self, album):
+        for track in album.get_tracks():
+            location = track.location
+
+            if location and location.startswith('file://'):
+                return location
+
+        return None
+
+    def _extract(self, uri):
+        # run on a worker thread
+        try:
+            mtime = os.stat(GLib.filename_from_uri(uri)[0]).st_mtime
+        except (GLib.GError, OSError):
+            return None
+
+        with self._lock:
+            if self._no_image.get(uri) == mtime:
+                # already read, it has no image
+                return None
+
+        time.sleep(EMBEDDED_ART_PLAYING_DELAY if self._playing
+                   else EMBEDDED_ART_DELAY)
+
+        pixbuf = extract_embedded_image(uri)
+
+        if not pixbuf:
+            with self._lock:
+                self._no_image[uri] = mtime
+
+        return pixbuf
+
+    def _extracted(self, album, pixbuf, error):
+        if error:
+            print('Error while extracting embedded art: ' + str(error))
+        elif pixbuf and album.cover is self._cover_man.unknown_cover:
+            self._cover_man.store_cover_pixbuf(album, pixbuf,
+                                               RB.ExtDBSourceType.EMBEDDED)
+
+        if self._save_id is None:
+            self._save_id = Gdk.threads_add_timeout_seconds(
+                GLib.PRIORITY_DEFAULT_IDLE, 5, self._save, None)
+
+    def _save(self, *args):
+        self._save_id = None
+
+        with self._lock:
+            cache = dict(self._no_image)
+
+        try:
+            save_json_file(self._path, cache)
+        except Exception as e:
+            print('Error while saving the embedded art cache: ' + str(e))
+
+        return False
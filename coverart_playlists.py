@@ -21,17 +21,228 @@ import urllib.parse
 import json
 import os
 import random
+import collections
 
 from gi.repository import RB
 from gi.repository import Gtk
 
 from coverart_utils import idle_iterator
+from coverart_utils import clean_url_cache
 import rb
 
 
 LOAD_CHUNK = 50
 
 
+class ArtistEntriesIndex(object):
+    '''
+    Index of the library's tracks by their folded artist, used to find the
+    tracks of similar artists without walking the whole library each time.
+
+    It's built once from the library, in idle slices, and then kept up to
+    date with the database's added, changed and deleted signals.
+
+    :param shell: `RB.Shell` whose library is indexed.
+    '''
+    instance = None
+
+    def __init__(self, shell):
+        self._db = shell.props.db
+        self._entry_type = shell.props.library_source.props.entry_type
+
+        # folded artist -> {entry id: entry}
+        self._artists = {}
+        # entry id -> folded artist, to find the entries when they change
+        self._entry_artists = {}
+
+        self._ready = False
+        self._waiting = []
+
+        self._signal_ids = [
+            self._db.connect('entry-added', self._entry_added_callback),
+            self._db.connect('entry-changed', self._entry_changed_callback),
+            self._db.connect('entry-deleted', self._entry_deleted_callback)]
+
+        query_model = shell.props.library_source.props.base_query_model
+        self._loader = self._load_entries(iter(query_model),
+                                          model=query_model)
+
+    @classmethod
+    def get_instance(cls, shell):
+        '''
+        Returns the unique instance of the index.
+        '''
+        if not cls.instance:
+            cls.instance = ArtistEntriesIndex(shell)
+
+        return cls.instance
+
+    @classmethod
+    def destroy_instance(cls):
+        '''
+        Disconnects the unique instance of the index from the database and
+        drops it, releasing the entries it holds. Called when the plugin is
+        deactivated.
+        '''
+        index = cls.instance
+
+        if not index:
+            return
+
+        cls.instance = None
+
+        for signal_id in index._signal_ids:
+            index._db.disconnect(signal_id)
+
+        index._loader.stop()
+        index._artists.clear()
+        index._entry_artists.clear()
+        index._waiting = []
+
+    def when_ready(self, callback):
+        '''
+        Calls `callback` once the index is built, right away if it already is.
+        '''
+        if self._ready:
+            callback()
+        else:
+            self._waiting.append(callback)
+
+    def get_entries(self, artist):
+        '''
+        Returns the library's entries of an artist.
+
+        :param artist: `str` folded name of the artist.
+        '''
+        return list(self._artists.get(artist, {}).values())
+
+    @idle_iterator
+    def _load_entries(self):
+        def process(row, data):
+            self._add_entry(data['model'][row.path][0])
+
+        def error(exception):
+            print(('Error indexing entries: ' + str(exception)))
+
+        def finish(data):
+            self._ready = True
+
+            waiting = self._waiting
+            self._waiting = []
+
+            for callback in waiting:
+                callback()
+
+        return LOAD_CHUNK, process, None, error, finish
+
+    def _add_entry(self, entry):
+        if entry.get_entry_type() != self._entry_type or \
+                entry.get_boolean(RB.RhythmDBPropType.HIDDEN):
+            return
+
+        entry_id = entry.get_ulong(RB.RhythmDBPropType.ENTRY_ID)
+        artist = entry.get_string(RB.RhythmDBPropType.ARTIST_FOLDED)
+
+        self._artists.setdefault(artist, {})[entry_id] = entry
+        self._entry_artists[entry_id] = artist
+
+    def _remove_entry(self, entry):
+        entry_id = entry.get_ulong(RB.RhythmDBPropType.ENTRY_ID)
+        artist = self._entry_artists.pop(entry_id, None)
+
+        if artist is None:
+            return
+
+        entries = self._artists[artist]
+        del entries[entry_id]
+
+        if not entries:
+            del self._artists[artist]
+
+    def _entry_added_callback(self, db, entry):
+        self._add_entry(entry)
+
+    def _entry_changed_callback(self, db, entry, changes):
+        # the artist may have changed or the entry may have been hidden
+        self._remove_entry(entry)
+        self._add_entry(entry)
+
+    def _entry_deleted_callback(self, db, entry):
+        self._remove_entry(entry)
+
+
+class CandidatePool(object):
+    '''
+    Tracks of similar artists waiting to be added to a playlist.
+
+    Each artist keeps a deque of its unplayed tracks, while the pool holds
+    one slot per unplayed track, so picking a random track is O(1). The
+    titles remembered for each artist (played or not) prevent a track from
+    being picked twice and limit the tracks taken from the same artist.
+
+    :param max_tracks: `int` maximum number of unplayed tracks remembered.
+    :param max_tracks_per_artist: `int` maximum number of tracks remembered
+        for the same artist.
+    '''
+
+    def __init__(self, max_tracks, max_tracks_per_artist):
+        self._max_tracks = max_tracks
+        self._max_tracks_per_artist = max_tracks_per_artist
+
+        # artist -> deque of unplayed entries
+        self._tracks = {}
+        # artist -> set of titles remembered
+        self._titles = {}
+        # one artist name per unplayed track
+        self._pool = []
+
+    def __len__(self):
+        return len(self._pool)
+
+    def add(self, artist, title, entry):
+        '''
+        Remembers a track unless the pool is full or the artist has enough
+        tracks already. Returns True if the track was added.
+        '''
+        titles = self._titles.setdefault(artist, set())
+
+        if len(self._pool) >= self._max_tracks or title in titles or \
+                len(titles) >= self._max_tracks_per_artist:
+            return False
+
+        titles.add(title)
+        self._tracks.setdefault(artist, collections.deque()).append(entry)
+        self._pool.append(artist)
+
+        return True
+
+    def pick(self, count):
+        '''
+        Removes and returns up to `count` random unplayed tracks.
+        '''
+        entries = []
+
+        while self._pool and len(entries) < count:
+            # swap the picked slot with the last one to remove it in O(1)
+            index = random.randrange(len(self._pool))
+            self._pool[index], self._pool[-1] = self._pool[-1], \
+                self._pool[index]
+            artist = self._pool.pop()
+
+            tracks = self._tracks[artist]
+            entries.append(tracks.popleft())
+
+            if not tracks:
+                del self._tracks[artist]
+
+        return entries
+
+    def clear(self):
+        self._tracks.clear()
+        self._titles.clear()
+        del self._pool[:]
+
+
 class WebPlaylist(object):
     MAX_TRACKS_TO_ADD = 3  # number of tracks to add to a source for each fetch
     MIN_TRACKS_TO_FETCH = 5  # number of tracks in source before a fetch will be required
@@ -42,20 +253,20 @@ class WebPlaylist(object):
 
         self.shell = shell
         # lets fill up the queue with artists
-        self.candidate_artist = {}
+        self.candidates = CandidatePool(self.TOTAL_TRACKS_REMEMBERED,
+                                        self.MAX_TRACKS_PER_ARTIST)
         self.shell.props.shell_player.connect('playing-song-changed', self.playing_song_changed)
         self.source = source
         self.search_entry = None
         self.playlist_started = False
         self.played_artist = {}
-        self.tracks_not_played = 0
         # cache for artist information: valid for a month, can be used indefinitely
         # if offline, discarded if unused for six months
         self.info_cache = rb.URLCache(name=playlist_name,
                                       path=os.path.join('coverart_browser', playlist_name),
                                       refresh=30,
                                       discard=180)
-        self.info_cache.clean()
+        clean_url_cache(self.info_cache)
 
     def playing_song_changed(self, player, entry):
         if not entry:
@@ -64,7 +275,7 @@ class WebPlaylist(object):
         if player.get_playing_source() != self.source:
             self.playlist_started = False
             self.played_artist.clear()
-            self.tracks_not_played = 0
+            self.candidates.clear()
 
         if self.playlist_started and len(self.source.props.query_model) < self.MIN_TRACKS_TO_FETCH:
             self.start(entry)
@@ -74,7 +285,7 @@ class WebPlaylist(object):
 
         if reinitialise:
             self.played_artist.clear()
-            self.tracks_not_played = 0
+            self.candidates.clear()
             self.playlist_started = False
 
             player = self.shell.props.shell_player
@@ -86,8 +297,8 @@ class WebPlaylist(object):
             for row in self.source.props.query_model:
                 self.source.props.query_model.remove_entry(row[0])
 
-        if self.tracks_not_played > self.TOTAL_TRACKS_REMEMBERED:
-            print(("we have plenty of tracks to play yet - no need to fetch more %d", self.tracks_not_played))
+        if len(self.candidates) >= self.TOTAL_TRACKS_REMEMBERED:
+            print(("we have plenty of tracks to play yet - no need to fetch more %d", len(self.candidates)))
             self.add_tracks_to_source()
             return
 
@@ -115,47 +326,26 @@ class WebPlaylist(object):
         self.search_artists = ""
         self._running = False
 
-    @idle_iterator
-    def _load_albums(self):
-        def process(row, data):
-            entry = data['model'][row.path][0]
-
-            lookup = entry.get_string(RB.RhythmDBPropType.ARTIST_FOLDED)
-            lookup_title = entry.get_string(RB.RhythmDBPropType.TITLE_FOLDED)
+    def _find_candidates(self):
+        '''
+        Looks for the library's tracks matching the similar artists and titles
+        found, once the artist index is ready.
+        '''
+        index = ArtistEntriesIndex.get_instance(self.shell)
+        index.when_ready(lambda: self._match_candidates(index))
 
-            if lookup in self.artist and \
-                            lookup_title in \
-                            self.artist[lookup]:
+    def _match_candidates(self, index):
+        for lookup, titles in self.artist.items():
+            titles = set(titles)
 
-                if lookup not in self.candidate_artist:
-                    self.candidate_artist[lookup] = []
+            for entry in index.get_entries(lookup):
+                lookup_title = entry.get_string(RB.RhythmDBPropType.TITLE_FOLDED)
 
-                # N.B. every artist has an array of dicts with a known format of track & add-to-source elements
-                # the following extracts the track-title and add-to-source to form a dict of track-title and a value
-                # of the add-to-source
-                d = dict((i['track-title'], i['add-to-source']) for i in self.candidate_artist[lookup])
-                if len(d) < self.MAX_TRACKS_PER_ARTIST and lookup_title not in d:
-                    # we only append a max of three tracks to each artist
-                    self.candidate_artist[lookup].append({
-                        'track': entry,
-                        'add-to-source': False,
-                        'track-title': lookup_title})
-                    self.tracks_not_played = self.tracks_not_played + 1
+                if lookup_title in titles:
+                    self.candidates.add(lookup, lookup_title, entry)
 
-
-        def after(data):
-            # update the progress
-            pass
-
-        def error(exception):
-            print(('Error processing entries: ' + str(exception)))
-
-        def finish(data):
-
-            self.add_tracks_to_source()
-            self._clear_next()
-
-        return LOAD_CHUNK, process, after, error, finish
+        self.add_tracks_to_source()
+        self._clear_next()
 
     def display_error_message(self):
         dialog = Gtk.MessageDialog(None,
@@ -168,32 +358,8 @@ class WebPlaylist(object):
         dialog.destroy()
 
     def add_tracks_to_source(self):
-        entries = []
-        for artist in self.candidate_artist:
-
-            d = dict((i['track'], (self.candidate_artist[artist].index(i),
-                                   i['add-to-source'],
-                                   artist)) for i in self.candidate_artist[artist])
-
-            for entry, elements in d.items():
-                element_pos, add_to_source, artist = elements
-                if not add_to_source:
-                    entries.append({entry: elements})
-
-        random.shuffle(entries)
-
-        count = 0
-        for row in entries:
-            print(row)
-            entry, elements = list(row.items())[0]
-            element_pos, add_to_source, artist = elements
+        for entry in self.candidates.pick(self.MAX_TRACKS_TO_ADD):
             self.source.add_entry(entry, -1)
-            self.candidate_artist[artist][element_pos]['add-to-source'] = True
-
-            count = count + 1
-            self.tracks_not_played = self.tracks_not_played - 1
-            if count == self.MAX_TRACKS_TO_ADD:
-                break
 
         player = self.shell.props.shell_player
 
@@ -254,13 +420,9 @@ class LastFMTrackPlaylist(WebPlaylist):
             self._clear_next()
             return
 
-        # loop through every track - see if the track contains the artist & title
-        # if yes then this is a candidate similar track to remember
-
-        query_model = self.shell.props.library_source.props.base_query_model
-
-        self._load_albums(iter(query_model), albums={}, model=query_model,
-                          total=len(query_model), progress=0.)
+        # look for the tracks of the artists returned - if the track title
+        # matches then this is a candidate similar track to remember
+        self._find_candidates()
 
 
 class EchoNestPlaylist(WebPlaylist):
@@ -311,13 +473,9 @@ class EchoNestPlaylist(WebPlaylist):
             self._clear_next()
             return
 
-        # loop through every track - see if the track contains the artist & title
-        # if yes then this is a candidate similar track to remember
-
-        query_model = self.shell.props.library_source.props.base_query_model
-
-        self._load_albums(iter(query_model), albums={}, model=query_model,
-                          total=len(query_model), progress=0.)
+        # look for the tracks of the artists returned - if the track title
+        # matches then this is a candidate similar track to remember
+        self._find_candidates()
 
 
 class EchoNestGenrePlaylist(WebPlaylist):
@@ -368,10 +526,6 @@ class EchoNestGenrePlaylist(WebPlaylist):
             self._clear_next()
             return
 
-        # loop through every track - see if the track contains the artist & title
-        # if yes then this is a candidate similar track to remember
-
-        query_model = self.shell.props.library_source.props.base_query_model
-
-        self._load_albums(iter(query_model), albums={}, model=query_model,
-                          total=len(query_model), progress=0.)
+        # look for the tracks of the artists returned - if the track title
+        # matches then this is a candidate similar track to remember
+        self._find_candidates()
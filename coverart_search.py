@@ -19,12 +19,13 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301  USA.
 
 from gi.repository import Gtk
-from mako.template import Template
 
 import rb
 import coverart_rb3compat as rb3compat
 from coverart_album import Album
 from coverart_browser_prefs import webkit_support
+from coverart_utils import get_template
+from coverart_utils import render_template_cached
 
 
 class CoverSearchPane(Gtk.Box):
@@ -57,26 +58,15 @@ class CoverSearchPane(Gtk.Box):
         '''
         Loads the templates and stylesheets to be used by the pane.
         '''
-        # input_encoding='utf-8',
-
-        path = rb.find_plugin_file(plugin,
-                                   'tmpl/albumartsearch-tmpl.html')
-        self.template = Template(filename=path,
-                                 default_filters=['decode.utf8'],
-                                 module_directory='/tmp/',
-                                 encoding_errors='replace')
-        path = rb.find_plugin_file(plugin,
-                                   'tmpl/albumartsearchempty-tmpl.html')
-        self.empty_template = Template(filename=path,
-                                       default_filters=['decode.utf8'],
-                                       module_directory='/tmp/',
-                                       encoding_errors='replace')
-        path = rb.find_plugin_file(plugin,
-                                   'tmpl/artistartsearch-tmpl.html')
-        self.artist_template = Template(filename=path,
-                                        default_filters=['decode.utf8'],
-                                        module_directory='/tmp/',
-                                        encoding_errors='replace')
+        options = {'default_filters': ['decode.utf8'],
+                   'encoding_errors': 'replace'}
+
+        self.template = get_template(plugin, 'albumartsearch-tmpl.html',
+                                     **options)
+        self.empty_template = get_template(
+            plugin, 'albumartsearchempty-tmpl.html', **options)
+        self.artist_template = get_template(
+            plugin, 'artistartsearch-tmpl.html', **options)
         self.styles = rb.find_plugin_file(plugin, 'tmpl/main.css')
 
     def init_gui(self):
@@ -167,7 +157,8 @@ class CoverSearchPane(Gtk.Box):
         Clears the webview of any specific info/covers.
         '''
         self.current_searchobject = None
-        temp_file = self.empty_template.render(stylesheet=self.styles)
+        temp_file = render_template_cached(self.empty_template,
+                                           stylesheet=self.styles)
 
         self.webview.load_string(temp_file, 'text/html', 'utf-8',
                                  self.basepath)
@@ -17,8 +17,12 @@
 from bisect import bisect_left, bisect_right
 import collections
 import re
+import os
+import json
 import logging
 import sys
+import threading
+import time
 from collections import namedtuple
 
 from gi.repository import GdkPixbuf
@@ -29,6 +33,7 @@ from gi.repository import RB
 from gi.repository import GObject
 from gi.repository import Gio
 import lxml.etree as ET
+from mako.lookup import TemplateLookup
 
 import rb
 from coverart_browser_prefs import CoverLocale
@@ -412,6 +417,288 @@ def idle_iterator(func):
     return iter_function
 
 
+def save_json_file(path, data):
+    '''
+    Atomically saves data as json on the given path, creating its directory
+    if needed. When there's no data, the file is removed instead.
+    '''
+    if not data:
+        if os.path.exists(path):
+            os.remove(path)
+
+        return
+
+    directory = os.path.dirname(path)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    temp = path + '.tmp'
+    with open(temp, 'w') as json_file:
+        json.dump(data, json_file)
+
+    os.rename(temp, path)
+
+
+class LRUCache(object):
+    '''
+    Dictionary-like cache that keeps at most `size` elements, discarding the
+    least recently used ones when it's full.
+
+    :param size: `int` maximum number of elements kept.
+    '''
+
+    def __init__(self, size):
+        self._size = size
+        self._elements = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._elements
+
+    def __len__(self):
+        return len(self._elements)
+
+    def get(self, key, default=None):
+        '''
+        Returns the element for the key, marking it as the most recently
+        used one.
+        '''
+        if key not in self._elements:
+            return default
+
+        value = self._elements.pop(key)
+        self._elements[key] = value
+
+        return value
+
+    def put(self, key, value):
+        self._elements.pop(key, None)
+        self._elements[key] = value
+
+        while len(self._elements) > self._size:
+            self._elements.popitem(last=False)
+
+    def clear(self):
+        self._elements.clear()
+
+
+# paths of the url caches already cleaned (or being cleaned) on this session
+_cleaned_url_caches = set()
+
+# seconds each slice of a cache cleanup can take
+URL_CACHE_CLEAN_BUDGET = 0.005
+
+
+def clean_url_cache(cache):
+    '''
+    Does the same as `rb.URLCache.clean`, removing the entries past their
+    lifetime or unused for longer than the discard time, but as a low
+    priority idle job that only works for a few milliseconds each time. Each
+    cache is only cleaned once per session.
+
+    :param cache: `rb.URLCache` to clean.
+    '''
+    if cache.path in _cleaned_url_caches or not os.path.isdir(cache.path):
+        return
+
+    _cleaned_url_caches.add(cache.path)
+    entries = os.scandir(cache.path)
+    now = time.time()
+
+    def clean_slice(*args):
+        deadline = time.time() + URL_CACHE_CLEAN_BUDGET
+
+        for entry in entries:
+            try:
+                stat = entry.stat()
+
+                expired = cache.lifetime != -1 and \
+                    stat.st_mtime + cache.lifetime * 86400 < now
+                unused = cache.discard != -1 and \
+                    stat.st_atime + cache.discard * 86400 < now
+
+                if expired or unused:
+                    os.unlink(entry.path)
+            except OSError as e:
+                print("error while cleaning cache entry %s: %s" % (entry.path,
+                                                                   e))
+
+            if time.time() > deadline:
+                # keep going on the next idle slice
+                return True
+
+        return False
+
+    GLib.idle_add(clean_slice, priority=GLib.PRIORITY_LOW)
+
+
+def discard_url_cache_entry(cache, key):
+    '''
+    Removes an entry of a `rb.URLCache`, e.g. when its data turns out to be
+    invalid after the cache accepted it, so it's fetched again next time.
+
+    :param cache: `rb.URLCache` holding the entry.
+    :param key: `str` key of the entry.
+    '''
+    try:
+        os.unlink(cache.cachefile(key))
+    except OSError:
+        pass
+
+
+# mako lookups used to load the templates, by directory and options
+_template_lookups = {}
+
+
+def get_template(plugin, name, **options):
+    '''
+    Returns the `mako.template.Template` for a template on the plugin's tmpl
+    folder. Templates are compiled once into python modules kept on the
+    plugin's cache dir, so they're not lexed and compiled on every start.
+
+    :param plugin: plugin used to find the template.
+    :param name: `str` file name of the template.
+    :param options: extra options passed to mako, like `default_filters`.
+    '''
+    directory = os.path.dirname(rb.find_plugin_file(plugin, 'tmpl/' + name))
+    key = (directory, repr(sorted(options.items())))
+
+    if key not in _template_lookups:
+        _template_lookups[key] = TemplateLookup(
+            directories=[directory],
+            module_directory=RB.user_cache_dir() + '/coverart_browser/tmpl',
+            **options)
+
+    return _template_lookups[key].get_template(name)
+
+
+# html of the last rendered static pages (loading, empty...)
+_rendered_templates = LRUCache(32)
+
+
+def render_template_cached(template, **kwargs):
+    '''
+    Renders a template, reusing the previous result if it was already
+    rendered with the same arguments. Only meant for templates whose output
+    depends just on their arguments.
+    '''
+    key = (template.uri, tuple(sorted(kwargs.items())))
+    rendered = _rendered_templates.get(key)
+
+    if rendered is None:
+        rendered = template.render(**kwargs)
+        _rendered_templates.put(key, rendered)
+
+    return rendered
+
+
+class WorkerPool(object):
+    '''
+    Pool of worker threads that run jobs off the main loop.
+
+    A job is a callable run on one of the worker threads; its result (or the
+    exception raised) is handed back to the main loop through the job's
+    callback so it's safe to touch GTK objects from it.
+
+    :param workers: `int` number of worker threads.
+    :param priority: main loop priority used when calling the callbacks.
+    '''
+
+    def __init__(self, workers=2, priority=GLib.PRIORITY_DEFAULT_IDLE):
+        self._workers = max(1, workers)
+        self._priority = priority
+        self._jobs = collections.deque()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._generation = 0
+        self._busy = 0
+
+    def _start_workers(self):
+        self._threads = [thread for thread in self._threads
+                         if thread.is_alive()]
+
+        while len(self._threads) < self._workers:
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._jobs:
+                    if not self._condition.wait(30):
+                        # idle for a while, let the thread finish
+                        if not self._jobs:
+                            self._threads.remove(threading.current_thread())
+                            return
+
+                generation, func, args, callback = self._jobs.popleft()
+                self._busy += 1
+
+            try:
+                result = func(*args)
+                error = None
+            except Exception as e:
+                result = None
+                error = e
+
+            with self._condition:
+                self._busy -= 1
+                self._condition.notify_all()
+
+            if callback and generation == self._generation:
+                Gdk.threads_add_idle(self._priority, self._callback,
+                                     (generation, callback, result, error))
+
+    def _callback(self, data):
+        generation, callback, result, error = data
+
+        # jobs cancelled after they finished shouldn't report back
+        if generation == self._generation:
+            callback(result, error)
+
+        return False
+
+    def add_job(self, func, callback=None, *args):
+        '''
+        Queues a job to be run on a worker thread.
+
+        :param func: `callable` to run on the worker thread with `args`.
+        :param callback: `callable` called on the main loop with the result
+            of `func` and the exception it raised (or None).
+        '''
+        with self._condition:
+            self._jobs.append((self._generation, func, args, callback))
+            self._start_workers()
+            self._condition.notify()
+
+    def pending(self):
+        '''
+        Returns the number of jobs still waiting for a worker.
+        '''
+        return len(self._jobs)
+
+    def join(self):
+        '''
+        Waits until there are no jobs pending nor running. Must not be called
+        from one of the pool's own workers.
+        '''
+        with self._condition:
+            while self._jobs or self._busy:
+                self._condition.wait()
+
+    def cancel(self):
+        '''
+        Drops all the pending jobs. Jobs already running will finish but
+        their callbacks won't be called.
+        '''
+        with self._condition:
+            self._jobs.clear()
+            self._generation += 1
+
+
 class Theme:
     '''
     This class manages the theme details
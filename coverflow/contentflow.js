@@ -330,53 +330,88 @@ function jscallback(msg) {
     
 };
 
-function update_album(msg) {
-    var obj = eval('(' + msg + ')');
-    var index = Math.floor(obj.identifier);
-    var item = cf.getItem(index);
-    //console.log(item.content.getAttribute('src'))
-    //item.content.setAttribute('src', '/home/dad/.cache/rhythmbox/album-art/000000ab');
-    //item.content.setAttribute('src', obj.filename);
-    //item.caption.innerHTML = obj.caption;
-    //item.content.setAttribute('title', obj.title);
-    //console.log(x);
-    console.log(index)
-    console.log(item.pre)
-    console.log(item.pre.index)
-    var element = cf.rmItem(index)
-    item = cf.getActiveItem()
-    console.log(item.index)
-    var link = document.createElement('img');
-    link.setAttribute('src', obj.filename);
-    link.setAttribute('title', obj.title);
-    link.setAttribute('caption', obj.filename);
-    link.setAttribute('identifier', obj.identifier);
-    cf.addItem(link, index - 1);
-    cf.moveTo(index - 1)
+/* returns the index of the flow item with the given identifier or -1 */
+function flow_index(identifier) {
+    for (var i = 0; i < cf.items.length; i++) {
+        if (cf.items[i].content.getAttribute('identifier') == identifier)
+            return i;
+    }
+    return -1;
 };
 
-function new_flow_batch(msg) {
-    return;
-    var obj = eval('(' + msg + ')');
-    var ic = document.getElementById('flow');
-    var position = obj.batchtype;
-    
-    if (position != 'stop') {
-        for (var i=0; i < obj.flowbatch.length; i++) {
-            var link = document.createElement('img');
-            link.setAttribute('src', obj.flowbatch[i].filename);
-            link.setAttribute('title', obj.flowbatch[i].title);
-            link.setAttribute('caption', obj.flowbatch[i].filename);
-            link.setAttribute('identifier', obj.flowbatch[i].identifier);
-            cf.addItem(link, position);
+/* creates the html structure of a flow item from the python item object */
+function flow_item(obj) {
+    var el = document.createElement('div');
+    el.className = "item";
+
+    var img = document.createElement('img');
+    img.className = "content";
+    img.setAttribute('src', obj.filename);
+    img.setAttribute('thumbnail', obj.filename);
+    img.setAttribute('original', obj.original);
+    img.setAttribute('title', obj.title);
+    img.setAttribute('identifier', obj.identifier);
+    el.appendChild(img);
+
+    var cap = document.createElement('div');
+    cap.className = "caption";
+    cap.textContent = obj.caption;
+    el.appendChild(cap);
+
+    return el;
+};
+
+/* removes the item with the given identifier, even if it is still queued */
+function remove_identifier(identifier) {
+    var index = flow_index(identifier);
+    if (index >= 0) {
+        cf.rmItem(index);
+        return;
+    }
+
+    var cue = cf._addItemCue;
+    for (var i = 1; i < cue.length; i++) {
+        if (cue[i].el.getElementsByTagName('img')[0].getAttribute('identifier') == identifier) {
+            cue.splice(i, 1);
+            return;
         }
     }
-    ContentFlowGlobal.batchmessage = null;
+};
+
+function update_album(obj) {
+    var index = flow_index(obj.identifier);
+    if (index < 0) return;
+
+    var item = cf.getItem(index);
+    item.content.setAttribute('thumbnail', obj.filename);
+    item.content.setAttribute('original', obj.original);
+    if (item != cf.getActiveItem())
+        item.content.setAttribute('src', obj.filename);
+    item.content.setAttribute('title', obj.title);
+    if (item.caption) item.caption.textContent = obj.caption;
+};
+
+/* 
+ * python streams the covers around the active item in and out of the flow
+ * so that the page only ever holds a window of the whole album list
+ */
+function update_flow_window(obj) {
+    for (var i = 0; i < obj.remove.length; i++) {
+        remove_identifier(obj.remove[i]);
+    }
+
+    for (var i = obj.prepend.length - 1; i >= 0; i--) {
+        cf.addItem(flow_item(obj.prepend[i]), 'start');
+    }
+
+    for (var i = 0; i < obj.append.length; i++) {
+        cf.addItem(flow_item(obj.append[i]), 'end');
+    }
 };
 
 function scroll_to_identifier(msg) {
-    var index = Math.floor(msg);
-    cf.moveTo(index);
+    var index = flow_index(msg);
+    if (index >= 0) cf.moveTo(index);
 };
 
 /* 
@@ -914,9 +949,20 @@ ContentFlow.prototype = {
             message_signal('dropactive', identifier, webpath);
         },
 
-        onMakeInactive: function (item) {},
+        onMakeInactive: function (item) {
+            /* only the active item shows the original size cover */
+            var thumbnail = item.content.getAttribute('thumbnail');
+            if (thumbnail) item.content.setAttribute('src', thumbnail);
+        },
+
+        onMakeActive: function (item) {
+            var original = item.content.getAttribute('original');
+            if (original) item.content.setAttribute('src', original);
 
-        onMakeActive: function (item) {},
+            var identifier;
+            identifier = item.content.getAttribute('identifier');
+            message_signal('activechanged', identifier);
+        },
 
         onReachTarget: function(item) {},
 